@@ -0,0 +1,50 @@
+# Run by IPython at the start of every kernel (installed into the
+# default profile's startup folder by the Dockerfile).
+#
+# `run.py` starts a kernel for the first notebook while the browser is
+# opening, so paying for these imports here means the notebook's first
+# cell doesn't have to. IPython runs this file in the user namespace, so
+# everything happens inside a function that is deleted afterwards: the
+# modules are loaded into `sys.modules` but no names are left behind, and
+# a notebook that forgets an import still fails as it would without this.
+
+
+def _prewarm():
+    import os
+    import threading
+
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+    import scipy.stats  # noqa: F401
+    import statsmodels.api  # noqa: F401
+
+    # With `python run.py --preload`, also import our own helpers and warm
+    # the OS page cache with the registered datasets, so the notebooks'
+    # own `pd.read_csv` calls read from memory rather than disk. Nothing is
+    # parsed or kept in the kernel. The page cache is shared by every
+    # kernel in the container, so only the first kernel to start (the one
+    # `run.py` pre-warms) does this, on a background thread.
+    if os.environ.get("EUCTR_PRELOAD") != "1":
+        return
+    import lib.functions  # noqa: F401
+    from lib.datasets import DATASETS, ROOT
+
+    try:
+        marker = os.open("/tmp/euctr_page_cache_warmed", os.O_CREAT | os.O_EXCL)
+    except FileExistsError:
+        return
+    os.close(marker)
+
+    def warm():
+        for spec in DATASETS.values():
+            path = ROOT / spec.path
+            if path.exists():
+                with open(path, "rb") as f:
+                    while f.read(1 << 20):
+                        pass
+
+    threading.Thread(target=warm, name="page-cache-warm", daemon=True).start()
+
+
+_prewarm()
+del _prewarm
@@ -0,0 +1,157 @@
+import argparse
+import csv as pycsv
+import io
+import time
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv
+
+from lib.datasets import DATASETS, ROOT, load_dataset
+
+#The full December 2020 dump from https://osf.io/tu5pz, if it has been downloaded. It has every
+#protocol column, so reading it with the 'protocols' schema projects out the ones the analysis uses
+RAW_DUMP = 'data/source_data/euctr_euctr_dump-2020-12-03-095517.csv.zip'
+
+_ARROW_TYPES = {'object': pa.string(), 'int64': pa.int64(), 'float64': pa.float64()}
+
+#pd.read_csv's default missing value markers, as of the pinned pandas 1.4. pandas 2 adds 'None',
+#which the searchers' datasets use as text
+_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+             'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null']
+
+#Dates are parsed at second resolution, which holds any year, then those datetime64[ns] can't
+#hold are made null before converting, as lib.datasets.parse_dates does
+_SECONDS = pa.timestamp('s')
+_NS_RANGE = (pa.scalar(datetime(1677, 9, 22), _SECONDS), pa.scalar(datetime(2262, 4, 11), _SECONDS))
+
+@contextmanager
+def _open(path):
+    #Zipped CSVs are decompressed as they are read rather than extracted first
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            members = [m for m in z.namelist() if not m.endswith('/')]
+            if len(members) != 1:
+                raise ValueError(f'{path} should hold a single CSV, not {members}')
+            with z.open(members[0]) as f:
+                yield f
+    else:
+        with open(path, 'rb') as f:
+            yield f
+
+def _header(path):
+    #Named as pandas names them, so unnamed index columns come out as 'Unnamed: n' and repeats as 'name.1'
+    with _open(path) as f:
+        names = next(pycsv.reader(io.TextIOWrapper(f, encoding='utf-8', newline='')))
+    seen = {}
+    for i, n in enumerate(names):
+        if n:
+            names[i] = n if n not in seen else f'{n}.{seen[n]}'
+            seen[n] = seen.get(n, 0) + 1
+    for i, n in enumerate(names):
+        if not n:
+            n, k = f'Unnamed: {i}', 0
+            while n in names:
+                k += 1
+                n = f'Unnamed: {i}.{k}'
+            names[i] = n
+    return names
+
+def _options(name, path, columns, block_size):
+    spec = DATASETS[name]
+    columns = list(spec.columns) if columns is None else list(columns)
+    unknown = [c for c in columns if c not in spec.columns]
+    if unknown:
+        raise KeyError(f'{name!r} has no column(s) {unknown}')
+    types = {c: _SECONDS if c in spec.dates else _ARROW_TYPES[spec.columns[c]] for c in columns}
+    formats = sorted({spec.dates[c] for c in columns if c in spec.dates})
+    header = _header(path)
+    missing = [c for c in columns if c not in header]
+    if missing:
+        raise ValueError(f'{path} does not have the {name!r} column(s) {missing}')
+    read = csv.ReadOptions(use_threads=True, block_size=block_size, column_names=header, skip_rows=1)
+    convert = csv.ConvertOptions(column_types=types, include_columns=columns, null_values=_NA_VALUES,
+                                 strings_can_be_null=True,
+                                 timestamp_parsers=formats or None)
+    return read, convert, [c for c in columns if c in spec.dates]
+
+def _to_ns(data, dates):
+    arrays = []
+    for name, column in zip(data.schema.names, data.columns):
+        if name in dates:
+            lo, hi = _NS_RANGE
+            in_range = pc.and_(pc.greater_equal(column, lo), pc.less_equal(column, hi))
+            column = pc.if_else(in_range, column, pa.scalar(None, _SECONDS)).cast(pa.timestamp('ns'))
+        arrays.append(column)
+    return type(data).from_arrays(arrays, names=data.schema.names)
+
+def read_batches(name, columns=None, path=None, root=ROOT, block_size=1 << 22):
+    """
+    Stream a dataset as Arrow record batches with the declared types and date formats.
+    Keyword arguments:
+    name -- A key of lib.datasets.DATASETS, for the schema
+    columns -- Optional list of columns to read. Default is all of the schema's columns
+    path -- Optional file to read instead of the dataset's own, e.g. RAW_DUMP. Extra columns in it are skipped
+    root -- The repo root relative paths are taken from
+    block_size -- Bytes of CSV per batch
+    """
+    path = Path(root) / (path or DATASETS[name].path)
+    read, convert, dates = _options(name, path, columns, block_size)
+    with _open(path) as f:
+        for batch in csv.open_csv(f, read_options=read, convert_options=convert):
+            yield _to_ns(batch, dates)
+
+def read_table(name, columns=None, path=None, root=ROOT, block_size=1 << 22):
+    """
+    Read a whole dataset as an Arrow table, with blocks parsed and converted on all cores.
+    Arguments are as for read_batches.
+    """
+    path = Path(root) / (path or DATASETS[name].path)
+    read, convert, dates = _options(name, path, columns, block_size)
+    with _open(path) as f:
+        return _to_ns(csv.read_csv(f, read_options=read, convert_options=convert), dates)
+
+def read_frame(name, columns=None, path=None, root=ROOT):
+    """read_table as a DataFrame, typed as load_dataset would give it"""
+    return read_table(name, columns, path, root).to_pandas()
+
+def benchmark(name, columns=None, repeat=3, root=ROOT):
+    """
+    Best-of-repeat seconds to load a dataset with pd.read_csv as the notebooks do, with
+    load_dataset, and with read_frame.
+    Keyword arguments:
+    name -- A key of lib.datasets.DATASETS
+    columns -- Optional list of columns to read
+    repeat -- Times to run each
+    root -- The repo root
+    """
+    path = Path(root) / DATASETS[name].path
+    readers = {
+        'pandas read_csv': lambda: pd.read_csv(path, low_memory=False, usecols=columns),
+        'load_dataset': lambda: load_dataset(name, usecols=columns, root=root),
+        'arrow read_frame': lambda: read_frame(name, columns, root=root),
+    }
+    timings = {}
+    for label, reader in readers.items():
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            reader()
+            best = min(best, time.perf_counter() - start)
+        timings[label] = best
+    return pd.Series(timings, name=name)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare CSV loading paths for the source datasets')
+    parser.add_argument('datasets', nargs='*', default=['protocols', 'results_scrape'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print(pd.concat([benchmark(name, repeat=args.repeat) for name in args.datasets], axis=1).round(3).to_string())
+
+if __name__ == '__main__':
+    main()
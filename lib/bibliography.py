@@ -0,0 +1,341 @@
+import argparse
+import calendar
+import gzip
+import json
+import time
+import xml.etree.ElementTree as ET
+from datetime import date
+from pathlib import Path
+from urllib.parse import unquote
+
+import pandas as pd
+import numpy as np
+
+from lib.datasets import ROOT, load_dataset
+from lib.registry_ids import extract_ids
+
+#Built by build_index from metadata dumps, which are too big to commit
+DEFAULT_INDEX = ROOT / 'data' / 'source_data' / 'bib_index'
+
+#Dates kept for each DOI: first online, in print, and Crossref's 'issued', the earliest it knows of
+DATE_KINDS = ['online', 'print', 'issued']
+#How much of a date the source gave. A date given only to the month or year is stored as its first day
+PRECISIONS = ['day', 'month', 'year']
+
+_MISSING = np.iinfo(np.int32).max
+_EPOCH = date(1970, 1, 1).toordinal()
+_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_abbr) if name}
+
+def normalize_doi(values):
+    """
+    DOIs in a comparable form: URL decoded, without any doi.org or 'doi:' prefix, and lower case
+    (DOIs are case insensitive). Accepts the links in journal_link as they are.
+    Keyword arguments:
+    values -- A series or list of DOIs or DOI links
+    """
+    s = pd.Series(values, dtype=object)
+    s = s.map(unquote, na_action='ignore')
+    return (s.str.strip().str.replace(r'^(?:https?://)?(?:dx\.)?doi\.org/|^doi:\s*', '', regex=True, case=False)
+            .str.lower())
+
+def _date(year, month=None, day=None):
+    #Days since 1970 and a PRECISIONS code, or None for no usable year
+    try:
+        year = int(year)
+        month = int(month) if month not in (None, '') else None
+        day = int(day) if day not in (None, '') and month else None
+        days = date(year, month or 1, day or 1).toordinal() - _EPOCH
+    except (TypeError, ValueError):
+        return None
+    return days, 0 if day else 1 if month else 2
+
+def _crossref_date(item, key):
+    parts = ((item.get(key) or {}).get('date-parts') or [[None]])[0] or [None]
+    return _date(*parts[:3])
+
+def _crossref_docs(f):
+    #API exports hold a message per line and are read a line at a time. A first line that isn't
+    #JSON on its own starts a pretty-printed single document, e.g. a public data file member
+    #holding {"items": [...]}, which has to be read whole
+    lines = (line for line in f if line.strip())
+    first = next(lines, None)
+    if first is None:
+        return
+    try:
+        doc = json.loads(first)
+    except json.JSONDecodeError:
+        yield json.loads(first + f.read())
+        return
+    yield doc
+    for line in lines:
+        yield json.loads(line)
+
+def _crossref_items(f):
+    for doc in _crossref_docs(f):
+        doc = doc.get('message', doc)
+        yield from doc.get('items', [doc])
+
+def read_crossref(path):
+    """
+    (doi, dates, text) for every work in a Crossref metadata file: .json or .jsonl, optionally gzipped.
+    dates is a tuple of _date results in DATE_KINDS order; text is where registry IDs are looked for,
+    the clinical-trial-number entries and abstract.
+    """
+    with _open(path) as f:
+        for item in _crossref_items(f):
+            doi = item.get('DOI')
+            if not doi:
+                continue
+            dates = (_crossref_date(item, 'published-online'), _crossref_date(item, 'published-print'),
+                     _crossref_date(item, 'issued'))
+            numbers = [c.get('clinical-trial-number', '') for c in item.get('clinical-trial-number') or []]
+            yield doi, dates, ' '.join(numbers + [item.get('abstract') or ''])
+
+def _pubmed_date(el):
+    if el is None:
+        return None
+    year, month, day = el.findtext('Year'), el.findtext('Month'), el.findtext('Day')
+    if year is None:
+        #e.g. <MedlineDate>2010 Mar-Apr</MedlineDate>
+        words = (el.findtext('MedlineDate') or '').split()
+        year = words[0] if words else None
+        month = words[1][:3] if len(words) > 1 else None
+    if month is not None and not month.isdigit():
+        month = _MONTHS.get(month[:3].lower())
+    return _date(year, month, day)
+
+def read_pubmed(path):
+    """
+    (doi, dates, text) for every article with a DOI in a PubMed XML file, e.g. a baseline file,
+    optionally gzipped. Online is the electronic ArticleDate, print the journal issue's PubDate.
+    text is the DataBank accession numbers and abstract.
+    """
+    with _open(path) as f:
+        for _, el in ET.iterparse(f):
+            if el.tag != 'PubmedArticle':
+                continue
+            doi = el.findtext(".//PubmedData/ArticleIdList/ArticleId[@IdType='doi']")
+            if doi:
+                article = el.find('.//Article')
+                online = _pubmed_date(article.find("ArticleDate[@DateType='Electronic']")) if article is not None else None
+                printed = _pubmed_date(el.find('.//Journal/JournalIssue/PubDate'))
+                numbers = [n.text or '' for n in el.iterfind('.//DataBank/AccessionNumberList/AccessionNumber')]
+                abstract = ' '.join(''.join(a.itertext()) for a in el.iterfind('.//Abstract/AbstractText'))
+                yield doi, (online, printed, None), ' '.join(numbers + [abstract])
+            el.clear()
+
+READERS = {'crossref': read_crossref, 'pubmed': read_pubmed}
+
+def _open(path):
+    path = Path(path)
+    return gzip.open(path, 'rb') if path.suffix == '.gz' else open(path, 'rb')
+
+def _format(path):
+    name = Path(path).name.lower()
+    return 'pubmed' if name.endswith(('.xml', '.xml.gz')) else 'crossref'
+
+def _blob(strings):
+    #Strings packed end to end as UTF-8, with offsets[i]:offsets[i + 1] the bytes of string i
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def _unblob(blob, offsets, rows):
+    return [bytes(blob[offsets[r]:offsets[r + 1]]).decode('utf-8') for r in rows]
+
+def _chunk(records):
+    #One chunk of records as compact arrays: key, packed date/precision per kind, DOI, IDs
+    dois = normalize_doi([r[0] for r in records])
+    packed = np.full((len(records), len(DATE_KINDS)), _MISSING, dtype=np.int64)
+    for i, (_, dates, _) in enumerate(records):
+        for k, d in enumerate(dates):
+            if d is not None:
+                #Precision first, so merging keeps the most precise date, then the earliest
+                packed[i, k] = (d[1] << 24) + d[0] + (1 << 23)
+    texts = pd.DataFrame({'text': [r[2] for r in records]})
+    found = extract_ids(texts, ['text'])
+    found = found[found.valid]
+    ids = found.groupby('record').id.agg(lambda s: '|'.join(sorted(set(s)))).reindex(range(len(records)), fill_value='')
+    keys = pd.util.hash_array(dois.to_numpy(dtype=object))
+    return keys, packed, dois.tolist(), ids.tolist()
+
+def build_index(dumps, path=DEFAULT_INDEX, chunk=500000):
+    """
+    Build the DOI index from Crossref and/or PubMed metadata files. A DOI in several files is
+    merged: for each kind of date the most precise, then earliest, is kept, and registry IDs are pooled.
+    Holds about 150 bytes per DOI in memory while building. Returns the number of DOIs indexed.
+    Keyword arguments:
+    dumps -- List of files. .xml(.gz) are read as PubMed, anything else as Crossref JSON
+    path -- Directory to write the index to. Existing index files there are replaced
+    chunk -- Records parsed before being packed into arrays
+    """
+    parts = []
+    for dump in dumps:
+        pending = []
+        for record in READERS[_format(dump)](dump):
+            pending.append(record)
+            if len(pending) >= chunk:
+                parts.append(_chunk(pending))
+                pending = []
+        if pending:
+            parts.append(_chunk(pending))
+    keys = np.concatenate([p[0] for p in parts]) if parts else np.empty(0, dtype=np.uint64)
+    packed = np.concatenate([p[1] for p in parts]) if parts else np.empty((0, len(DATE_KINDS)), dtype=np.int64)
+    dois = [d for p in parts for d in p[2]]
+    ids = [i for p in parts for i in p[3]]
+
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if len(keys) else np.empty(0, dtype=np.int64)
+    merged = np.minimum.reduceat(packed[order], starts, axis=0) if len(keys) else packed
+    first = order[starts]
+    out_ids = [ids[r] for r in first]
+    #The few DOIs seen more than once have their IDs pooled; a different DOI under the same key would be a hash collision
+    ends = np.append(starts[1:], len(keys))
+    for g in np.flatnonzero(ends - starts > 1):
+        rows = order[starts[g]:ends[g]]
+        if len({dois[r] for r in rows}) > 1:
+            raise ValueError(f'DOI hash collision: {sorted({dois[r] for r in rows})}')
+        out_ids[g] = '|'.join(sorted({i for r in rows for i in ids[r].split('|') if i}))
+
+    missing = merged == _MISSING
+    days = np.where(missing, _MISSING, (merged & ((1 << 24) - 1)) - (1 << 23)).astype(np.int32)
+    precision = np.where(missing, -1, merged >> 24).astype(np.int8)
+
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    np.save(path / 'keys.npy', keys[starts])
+    np.save(path / 'dates.npy', days)
+    np.save(path / 'precision.npy', precision)
+    for name, strings in (('dois', [dois[r] for r in first]), ('ids', out_ids)):
+        blob, offsets = _blob(strings)
+        blob.tofile(path / f'{name}.bin')
+        np.save(path / f'{name}_offsets.npy', offsets)
+    meta = {'count': int(len(starts)), 'dumps': [str(d) for d in dumps], 'built': pd.Timestamp.now().isoformat()}
+    (path / 'meta.json').write_text(json.dumps(meta, indent=1))
+    return len(starts)
+
+class BibIndex:
+    """
+    Read-only DOI lookups on an index written by build_index. Every file is memory mapped, so
+    opening is instant and a lookup reads only the pages its binary search and rows touch.
+
+    Example:
+    index = BibIndex()
+    index.lookup(['https://doi.org/10.1111/irv.12555'])
+    """
+
+    def __init__(self, path=DEFAULT_INDEX):
+        path = Path(path)
+        if not (path / 'keys.npy').exists():
+            raise FileNotFoundError(f'No index at {path}; create it with lib.bibliography.build_index()')
+        self.path = path
+        self.keys = np.load(path / 'keys.npy', mmap_mode='r')
+        self.dates = np.load(path / 'dates.npy', mmap_mode='r')
+        self.precision = np.load(path / 'precision.npy', mmap_mode='r')
+        self._blobs = {}
+        for name in ('dois', 'ids'):
+            offsets = np.load(path / f'{name}_offsets.npy', mmap_mode='r')
+            blob = (np.memmap(path / f'{name}.bin', dtype=np.uint8, mode='r') if offsets[-1]
+                    else np.empty(0, dtype=np.uint8))
+            self._blobs[name] = (blob, offsets)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return f'BibIndex({str(self.path)!r}, {len(self)} DOIs)'
+
+    def positions(self, dois):
+        """Row of each DOI in the index, or -1 if it isn't there. DOIs are normalized first"""
+        dois = normalize_doi(dois)
+        known = dois.notna().to_numpy()
+        hashed = pd.util.hash_array(dois[known].to_numpy(dtype=object))
+        rows = np.searchsorted(self.keys, hashed)
+        rows[rows >= len(self.keys)] = 0
+        hit = (self.keys[rows] == hashed) if len(self.keys) else np.zeros(len(rows), dtype=bool)
+        #The key is a hash, so a hit is confirmed against the stored DOI
+        blob, offsets = self._blobs['dois']
+        stored = _unblob(blob, offsets, rows[hit])
+        hit[hit] = np.asarray(stored, dtype=object) == dois[known].to_numpy(dtype=object)[hit]
+        out = np.full(len(dois), -1, dtype=np.int64)
+        out[np.flatnonzero(known)[hit]] = rows[hit]
+        return out
+
+    def lookup(self, dois):
+        """
+        Dates and registry IDs for each DOI, in input order. Columns: doi (normalized), found, a
+        date and <kind>_precision for each of DATE_KINDS, published (the most precise of them, then
+        the earliest) with published_precision, and registry_ids, a '|' separated string of canonical IDs.
+        Keyword arguments:
+        dois -- A series or list of DOIs or DOI links
+        """
+        index = dois.index if isinstance(dois, pd.Series) else None
+        rows = self.positions(dois)
+        found = rows >= 0
+        take = np.where(found, rows, 0)
+        days = np.where(found[:, None], self.dates[take] if len(self) else _MISSING, _MISSING)
+        precision = np.where(found[:, None], self.precision[take] if len(self) else -1, -1)
+        out = pd.DataFrame({'doi': normalize_doi(dois).to_numpy(), 'found': found}, index=index)
+
+        def as_dates(d):
+            return pd.to_datetime(np.where(d == _MISSING, np.iinfo(np.int64).min, d.astype(np.int64) * 86400 * 10**9))
+
+        for k, kind in enumerate(DATE_KINDS):
+            out[kind] = as_dates(days[:, k])
+            out[f'{kind}_precision'] = pd.Categorical.from_codes(precision[:, k], PRECISIONS)
+        #The most precise date, then the earliest, as build_index merges them: a date known only to
+        #the month is stored as the 1st, which would otherwise beat the exact date later that month
+        rank = np.where(days == _MISSING, np.iinfo(np.int64).max, (precision.astype(np.int64) << 32) + days)
+        earliest = np.argmin(rank, axis=1)
+        pick = np.arange(len(days))
+        out['published'] = as_dates(days[pick, earliest])
+        out['published_precision'] = pd.Categorical.from_codes(precision[pick, earliest], PRECISIONS)
+        blob, offsets = self._blobs['ids']
+        ids = np.full(len(rows), '', dtype=object)
+        ids[found] = _unblob(blob, offsets, rows[found])
+        out['registry_ids'] = ids
+        return out
+
+def resolve_links(final=None, index=None):
+    """
+    Look up every journal_link DOI in the final dataset at once and set what the index says
+    beside what the searchers recorded. Columns: euctr_id, journal_link, the lookup columns,
+    journal_pub_date, date_agrees (published to the day equals journal_pub_date) and
+    cites_trial (the metadata names the trial's EUCTR, NCT or ISRCTN ID).
+    Keyword arguments:
+    final -- The final dataset. Default is to load it
+    index -- A BibIndex. Default is the one at DEFAULT_INDEX
+    """
+    final = load_dataset('final_dataset') if final is None else final
+    index = BibIndex() if index is None else index
+    linked = final[final.journal_link.notna()]
+    found = index.lookup(linked.journal_link)
+    out = pd.concat([linked[['euctr_id', 'journal_link']], found], axis=1)
+    out['journal_pub_date'] = linked.journal_pub_date
+    out['date_agrees'] = ((out.published_precision == 'day') & (out.published == out.journal_pub_date)).astype(bool)
+    own = linked[[c for c in ('euctr_id', 'nct_id', 'isrctn_id') if c in linked.columns]].to_numpy(dtype=object)
+    out['cites_trial'] = [bool(ids) and any(isinstance(i, str) and i in ids.split('|') for i in row)
+                          for ids, row in zip(out.registry_ids, own)]
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the offline DOI index')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='Index Crossref JSON and/or PubMed XML files')
+    build.add_argument('dumps', nargs='+')
+    build.add_argument('--index', default=DEFAULT_INDEX)
+    resolve = sub.add_parser('resolve', help="Look up the final dataset's journal links")
+    resolve.add_argument('--index', default=DEFAULT_INDEX)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    if args.command == 'build':
+        print(f'Indexed {build_index(args.dumps, args.index)} DOIs in {time.perf_counter() - start:.1f}s')
+    else:
+        out = resolve_links(index=BibIndex(args.index))
+        print(f'{len(out)} links, {out.found.sum()} found, {out.date_agrees.sum()} dates agree, '
+              f'{out.cites_trial.sum()} cite the trial, in {time.perf_counter() - start:.2f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import fcntl
+import os
+import tempfile
+import weakref
+from contextlib import contextmanager
+from itertools import count
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from lib.datasets import load_dataset
+
+#File backed rather than /dev/shm, which Docker limits to 64 MB by default. Mapped pages are
+#still shared through the page cache by every process that attaches
+DEFAULT_CATALOG = Path(tempfile.gettempdir()) / 'euctr_catalog'
+
+#Total size of published datasets before unreferenced ones are evicted, further limited by the
+#free space where the catalog is
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+_tokens = count()
+
+def _types_mapper(arrow):
+    #Columns kept as Arrow arrays over the mapped pages rather than converted to numpy: every
+    #column as pd.ArrowDtype, or by default only strings, as string[pyarrow], so numbers and
+    #dates still come back as the numpy types the analysis functions expect
+    if arrow:
+        if not hasattr(pd, 'ArrowDtype'):
+            raise ValueError('arrow=True needs pandas 1.5 or later, for pd.ArrowDtype')
+        return pd.ArrowDtype
+    string = pd.StringDtype('pyarrow')
+    return {pa.string(): string, pa.large_string(): string}.get
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Catalog:
+    """
+    Datasets published once as Arrow IPC files and memory-mapped by every kernel or worker that
+    uses them, so the pages are held once, in the page cache, however many processes attach.
+    Each attachment leaves a reference file naming its process; once the total size passes
+    max_bytes, or the space free for it, the least recently used datasets with no live references
+    are evicted.
+
+    Example:
+    catalog = Catalog()
+    analysis_df = catalog.load('analysis_df')   #Published from lib.datasets on first use
+    with catalog.use('results_scrape') as table:
+        table.num_rows
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Keyword arguments:
+        path -- Directory to publish to. Every process sharing data must use the same one
+        max_bytes -- Size the catalog is kept under, as far as references allow. The free space on
+        path's file system lowers it further
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        (self.path / 'refs').mkdir(parents=True, exist_ok=True)
+
+    def _file(self, name):
+        return self.path / f'{name}.arrow'
+
+    def _refs(self, name):
+        return self.path / 'refs' / name
+
+    @contextmanager
+    def _lock(self):
+        with open(self.path / '.lock', 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __contains__(self, name):
+        return self._file(name).exists()
+
+    def publish(self, name, df):
+        """
+        Write a DataFrame (or Arrow table) to the catalog, replacing any earlier version. Processes
+        already attached to the old version keep it until they release it.
+        Keyword arguments:
+        name -- What to publish it as, usually a key of lib.datasets.DATASETS
+        df -- The data
+        """
+        table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+        with self._lock():
+            self._evict(keep=name, incoming=table.nbytes)
+        tmp = self.path / f'.{name}.{os.getpid()}.tmp'
+        with pa.OSFile(str(tmp), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        with self._lock():
+            #Renaming over the old file leaves existing mappings of it intact
+            os.replace(tmp, self._file(name))
+            self._evict(keep=name)
+
+    def attach(self, name):
+        """
+        Memory-map a published dataset as an Arrow table and take a reference to it.
+        Returns (table, token); pass the token to release when done.
+        """
+        with self._lock():
+            path = self._file(name)
+            if not path.exists():
+                raise KeyError(f'{name!r} has not been published to {self.path}')
+            table = pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+            refs = self._refs(name)
+            refs.mkdir(exist_ok=True)
+            token = refs / f'{os.getpid()}.{next(_tokens)}'
+            token.touch()
+            #Attaching counts as use, for eviction order
+            os.utime(path)
+        return table, token
+
+    def release(self, token):
+        """Drop a reference taken by attach"""
+        Path(token).unlink(missing_ok=True)
+
+    @contextmanager
+    def use(self, name):
+        """attach for the length of a with block"""
+        table, token = self.attach(name)
+        try:
+            yield table
+        finally:
+            self.release(token)
+
+    def load(self, name, columns=None, loader=load_dataset, arrow=False):
+        """
+        A published dataset as a DataFrame, publishing it first if needed. String columns
+        (string[pyarrow]) and numeric columns without missing values are views of the shared
+        pages; other numeric and date columns are converted to numpy, as the analysis functions
+        expect. With arrow=True every column is an Arrow-backed view (pd.ArrowDtype, pandas 1.5 or
+        later), with nulls as pd.NA. The reference is held until the DataFrame is garbage collected.
+        Keyword arguments:
+        name -- The dataset name
+        columns -- Optional list of columns to convert. Default is all of them
+        loader -- Called with name to read the dataset if it isn't published yet. Default is lib.datasets.load_dataset
+        arrow -- Keep every column as pd.ArrowDtype rather than converting numbers and dates to numpy
+        """
+        mapper = _types_mapper(arrow)
+        if name not in self:
+            self.publish(name, loader(name))
+        table, token = self.attach(name)
+        if columns is not None:
+            table = table.select(columns)
+        df = table.to_pandas(split_blocks=True, types_mapper=mapper)
+        weakref.finalize(df, self.release, token)
+        return df
+
+    def references(self, name):
+        """Number of live references to a dataset. References left by processes that have exited are cleared"""
+        refs = self._refs(name)
+        live = 0
+        for token in refs.glob('*') if refs.exists() else []:
+            if _alive(int(token.name.split('.')[0])):
+                live += 1
+            else:
+                token.unlink(missing_ok=True)
+        return live
+
+    def entries(self):
+        """Dict of published dataset to (bytes, live references)"""
+        return {f.stem: (f.stat().st_size, self.references(f.stem)) for f in self.path.glob('*.arrow')}
+
+    def evict(self, name):
+        """Remove a dataset whatever its references. Processes attached to it keep their mappings"""
+        with self._lock():
+            self._file(name).unlink(missing_ok=True)
+
+    def _evict(self, keep=None, incoming=0):
+        #Evicts until incoming more bytes would fit, in max_bytes and on the file system
+        files = sorted(self.path.glob('*.arrow'), key=lambda f: f.stat().st_mtime)
+        total = sum(f.stat().st_size for f in files)
+        stat = os.statvfs(self.path)
+        limit = min(self.max_bytes, total + stat.f_bavail * stat.f_frsize) - incoming
+        for f in files:
+            if total <= limit:
+                break
+            if f.stem != keep and self.references(f.stem) == 0:
+                total -= f.stat().st_size
+                f.unlink()
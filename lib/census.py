@@ -0,0 +1,78 @@
+import pandas as pd
+import numpy as np
+
+from lib.reporting import REGISTRY_IDS, RESULTS_SOURCES, results_dates
+
+def census_records(population, results, linked=None):
+    """
+    Per-trial records for every included trial in the register, shaped like the searchers'
+    dataset so the same analysis functions apply.
+    Keyword arguments:
+    population -- Output of lib.processing.trial_population
+    results -- The results section scrape, with first_version_date parsed
+    linked -- Optional DataFrame keyed by euctr_id with any other registry/journal columns
+    (nct_id, ctgov_results, ctgov_results_date, ...) to bring in
+    """
+    included = population.date_inclusion.to_numpy() == 1
+    records = pd.DataFrame({'euctr_id': population.eudract_number.to_numpy()[included],
+                            'final_date': population.final_date.to_numpy()[included],
+                            'inferred': population.inferred.to_numpy()[included]})
+    first_version = results.set_index('trial_id').first_version_date
+    records['euctr_results_date'] = records.euctr_id.map(first_version)
+    records['euctr_results'] = np.where(records.euctr_results_date.notnull(), 'Yes', 'No')
+    if linked is not None:
+        linked = linked.set_index('euctr_id')
+        for col in linked.columns:
+            records[col] = records.euctr_id.map(linked[col])
+    return records
+
+def _chunks(records, chunksize):
+    if isinstance(records, pd.DataFrame):
+        for start in range(0, len(records), chunksize):
+            yield records.iloc[start:start + chunksize]
+    else:
+        yield from records
+
+def census_summary(records, cutoff, by=None, chunksize=100000, z=1.96):
+    """
+    Number, proportion and CI of trials with results available by the cutoff in each source,
+    optionally broken down by one or more columns. Records are processed a chunk at a time
+    and only per-group counts are kept, so memory stays flat however many trials there are.
+    Keyword arguments:
+    records -- A DataFrame like census_records or analysis_df, or an iterable of such chunks
+    (e.g. pd.read_csv(..., chunksize=n)) with dates parsed
+    cutoff -- The date results had to be available by
+    by -- Optional column name or list of names to break the results down by, e.g. 'inferred'
+    chunksize -- Rows per chunk when records is a single DataFrame
+    z -- z-value for the CIs. Default 1.96 gives 95% CIs, as ci_calc
+    """
+    by = [] if by is None else [by] if isinstance(by, str) else list(by)
+    cutoff = pd.to_datetime(cutoff)
+    totals = None
+    for chunk in _chunks(records, chunksize):
+        sources = {k: v for k, v in RESULTS_SOURCES.items() if v[0] in chunk.columns}
+        reported = results_dates(chunk, sources) <= cutoff
+        counts = {}
+        for name in reported.columns:
+            eligible = chunk[REGISTRY_IDS[name]].notnull() if name in REGISTRY_IDS and REGISTRY_IDS[name] in chunk.columns \
+                else pd.Series(True, index=chunk.index)
+            counts[(name, 'reported')] = (reported[name] & eligible).astype(np.int64)
+            counts[(name, 'total')] = eligible.astype(np.int64)
+        counts = pd.DataFrame(counts)
+        if by:
+            counts = counts.groupby([chunk[b] for b in by]).sum()
+        else:
+            counts = counts.sum().to_frame('all').T
+        totals = counts if totals is None else totals.add(counts, fill_value=0)
+
+    summary = totals.stack(0)
+    summary.index = summary.index.set_names(by + ['source'] if by else [None, 'source'])
+    if not by:
+        summary = summary.droplevel(0)
+    summary = summary[['reported', 'total']].astype(np.int64)
+    p = summary.reported / summary.total.replace(0, np.nan)
+    margin = z * np.sqrt(p * (1 - p) / summary.total.replace(0, np.nan))
+    summary['proportion'] = p
+    summary['ci_lower'] = p - margin
+    summary['ci_upper'] = p + margin
+    return summary
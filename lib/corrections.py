@@ -0,0 +1,59 @@
+import pandas as pd
+import numpy as np
+
+from lib.datasets import load_dataset
+
+#In old_value, this means "whatever it was"; an empty old_value means it should have been missing
+ANY_VALUE = '*'
+
+def _as_dtype(values, dtype):
+    if pd.api.types.is_numeric_dtype(dtype):
+        return pd.to_numeric(values)
+    return values
+
+def apply_corrections(df, corrections=None, key='trial_id'):
+    """
+    Apply a table of manual corrections to any dataset in one keyed update per field.
+    A correction is only applied if the value it replaces is still what the table expects;
+    anything else is left alone and reported.
+    Keyword arguments:
+    df -- The dataset to correct. It is not modified
+    corrections -- DataFrame with trial_id, field, old_value, new_value (and reason) columns.
+    Default is data/additional_data/manual_corrections.csv
+    key -- The column of df holding the trial ID, or None to use the index
+
+    Returns (corrected copy of df, DataFrame of corrections that were not applied with the value found and why)
+    Corrections for fields df doesn't have are ignored, so one table can serve every dataset.
+    Apply it to data before correction, as the processing notebook does: outputs that already have
+    the corrections, such as spon_country_data.csv, report their exact old values as mismatches.
+    """
+    if corrections is None:
+        corrections = load_dataset('manual_corrections')
+    if corrections.duplicated(['trial_id', 'field']).any():
+        dupes = corrections[corrections.duplicated(['trial_id', 'field'], keep=False)]
+        raise ValueError(f'More than one correction for the same trial and field:\n{dupes}')
+
+    out = df.copy()
+    keys = pd.Series(out.index if key is None else out[key].to_numpy(), index=out.index)
+    problems = []
+    for field, group in corrections[corrections.field.isin(out.columns)].groupby('field', sort=False):
+        group = group.set_index('trial_id')
+        rows = keys.isin(group.index)
+        missing = group.index.difference(keys[rows])
+        if len(missing):
+            problems.append(group.loc[missing].reset_index().assign(found=np.nan, problem='trial not found'))
+
+        trial = keys[rows]
+        current = out.loc[rows, field]
+        expected = _as_dtype(trial.map(group.old_value.where(group.old_value != ANY_VALUE)), out[field].dtype)
+        wildcard = trial.map(group.old_value == ANY_VALUE).astype(bool)
+        ok = wildcard | (current == expected) | (current.isna() & expected.isna())
+        if not ok.all():
+            stale = group.loc[trial[~ok]].reset_index()
+            problems.append(stale.assign(found=current[~ok].to_numpy(), problem='old value mismatch'))
+
+        new = _as_dtype(trial[ok].map(group.new_value), out[field].dtype)
+        out.loc[new.index, field] = new
+    report = pd.concat(problems, ignore_index=True) if problems else \
+        pd.DataFrame(columns=list(corrections.columns) + ['found', 'problem'])
+    return out, report
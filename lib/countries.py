@@ -0,0 +1,137 @@
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+from scipy import sparse
+
+#Country code of protocols for sites outside the EU/EEA
+THIRD_COUNTRY = '3rd'
+
+#end_of_trial_status values, grouped into the counts status_exclude makes
+STATUS_GROUPS = {
+    'completed': ['Completed'],
+    'ongoing': ['Ongoing', 'Restarted'],
+    'terminated': ['Prematurely Ended'],
+    'suspended': ['Temporarily Halted', 'Suspended by CA'],
+    'other_status': ['Not Authorised', 'Prohibited by CA'],
+}
+
+CountryMatrix = namedtuple('CountryMatrix', ['trials', 'countries', 'statuses', 'presence', 'status', 'results'])
+CountryMatrix.__doc__ = """
+Trial x country sparse matrices built from the country protocols by country_matrix.
+trials -- Array of trial IDs, sorted, labelling the rows
+countries -- Array of country codes, sorted, labelling the columns
+statuses -- Array of end_of_trial_status values. status stores position + 1, with 0 for no status
+presence -- CSR int8 matrix, 1 where the trial has a protocol in the country
+status -- CSR int8 matrix with the same sparsity as presence holding status codes
+results -- CSR int8 matrix with the same sparsity as presence, 1 where the protocol has trial_results
+"""
+
+def country_matrix(protocols):
+    """
+    Build the trial x country matrices from the country-protocol scrape.
+    Keyword arguments:
+    protocols -- One row per eudract_number_with_country, with end_of_trial_status and trial_results
+    """
+    trial_codes, trials = pd.factorize(protocols.eudract_number, sort=True)
+    country_codes, countries = pd.factorize(protocols.eudract_number_with_country.str[15:], sort=True)
+    status_codes, statuses = pd.factorize(protocols.end_of_trial_status, sort=True)
+    shape = (len(trials), len(countries))
+
+    #Each trial/country pair occurs once. Building every layer on the same indices and indptr keeps
+    #explicit zeros, so the status and results layers line up entry for entry with presence
+    order = np.lexsort((country_codes, trial_codes))
+    indices = country_codes[order]
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(trial_codes, minlength=len(trials)))])
+
+    def layer(data):
+        return sparse.csr_matrix((np.asarray(data, dtype=np.int8)[order], indices, indptr), shape=shape)
+
+    presence = layer(np.ones(len(protocols)))
+    status = layer(status_codes + 1)
+    results = layer(protocols.trial_results.notnull())
+    return CountryMatrix(np.asarray(trials), np.asarray(countries), np.asarray(statuses), presence, status, results)
+
+def _columns(m, countries):
+    return np.flatnonzero(np.isin(m.countries, list(countries)))
+
+def countries_per_trial(m, exclude=None):
+    """
+    Number of country protocols for each trial.
+    Keyword arguments:
+    m -- A CountryMatrix
+    exclude -- Optional list of country codes not to count, e.g. [THIRD_COUNTRY]
+    """
+    presence = m.presence
+    if exclude is not None:
+        presence = presence[:, np.setdiff1d(np.arange(len(m.countries)), _columns(m, exclude))]
+    return pd.Series(np.asarray(presence.sum(axis=1)).ravel(), index=m.trials, name='number_of_countries')
+
+def trials_per_country(m):
+    """Number of trials with a protocol in each country"""
+    return pd.Series(np.asarray(m.presence.sum(axis=0)).ravel(), index=m.countries, name='trials')
+
+def trial_flags(m):
+    """
+    Per-trial country flags.
+    number_of_countries -- Protocols in any country, as status_exclude
+    eu_countries -- Protocols in EU/EEA countries
+    third_country -- Whether there is a protocol for sites outside the EU/EEA
+    eu_only -- All protocols are in the EU/EEA
+    multinational -- More than one country, counting outside the EU/EEA as one
+    """
+    total = countries_per_trial(m)
+    third = np.zeros(len(m.trials), dtype=bool)
+    cols = _columns(m, [THIRD_COUNTRY])
+    if len(cols):
+        third = np.asarray(m.presence[:, cols].sum(axis=1)).ravel() > 0
+    return pd.DataFrame({'number_of_countries': total,
+                         'eu_countries': total - third,
+                         'third_country': third,
+                         'eu_only': ~third,
+                         'multinational': total > 1}, index=m.trials)
+
+def status_summary(m):
+    """
+    The counts status_exclude makes for every trial (number_of_countries, completed, ongoing,
+    terminated, suspended, other_status, no_status, results) from the sparse layers.
+    """
+    rows = np.repeat(np.arange(len(m.trials)), np.diff(m.status.indptr))
+    n_codes = len(m.statuses) + 1
+    by_code = np.bincount(rows * n_codes + m.status.data, minlength=len(m.trials) * n_codes)
+    by_code = by_code.reshape(len(m.trials), n_codes)
+    out = pd.DataFrame({'number_of_countries': countries_per_trial(m)}, index=m.trials)
+    for group, values in STATUS_GROUPS.items():
+        out[group] = by_code[:, 1 + np.flatnonzero(np.isin(m.statuses, values))].sum(axis=1)
+    out['no_status'] = by_code[:, 0]
+    out['results'] = np.asarray(m.results.sum(axis=1)).ravel()
+    return out
+
+def co_registration(m, exclude=None):
+    """
+    Country x country counts of trials with protocols in both (the diagonal is trials_per_country).
+    Keyword arguments:
+    m -- A CountryMatrix
+    exclude -- Optional list of country codes to leave out
+    """
+    keep = np.arange(len(m.countries))
+    if exclude is not None:
+        keep = np.setdiff1d(keep, _columns(m, exclude))
+    presence = m.presence[:, keep].astype(np.int32)
+    counts = (presence.T @ presence).toarray()
+    return pd.DataFrame(counts, index=m.countries[keep], columns=m.countries[keep])
+
+def country_patterns(m, exclude=None):
+    """
+    How many trials have each exact combination of countries, most common first.
+    Keyword arguments:
+    m -- A CountryMatrix
+    exclude -- Optional list of country codes to leave out
+    """
+    keep = np.ones(len(m.countries), dtype=bool)
+    if exclude is not None:
+        keep[_columns(m, exclude)] = False
+    #Each combination as a bitmask over the countries, so only the distinct ones get labelled
+    bits = np.where(keep, 2 ** np.arange(len(m.countries), dtype=np.int64), 0)
+    counts = pd.Series(m.presence @ bits).value_counts()
+    labels = ['|'.join(m.countries[(code >> np.arange(len(m.countries))) & 1 == 1]) for code in counts.index]
+    return pd.Series(counts.to_numpy(), index=labels, name='trials')
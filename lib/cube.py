@@ -0,0 +1,174 @@
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+
+from lib.reporting import REGISTRY_IDS
+
+#Label of the rollup over every level of a dimension
+ALL = 'all'
+
+#Outcome name to results inclusion column, as in analysis_df
+OUTCOMES = {
+    'euctr': 'euctr_results_inc',
+    'ctgov': 'ctgov_results_inc',
+    'isrctn': 'isrctn_results_inc',
+    'journal': 'journal_results_inc',
+    'any': 'any_results_inc',
+}
+
+Cell = namedtuple('Cell', ['reported', 'total', 'proportion', 'ci_lower', 'ci_upper'])
+Cell.__doc__ = """
+The outcome counts for one slice of an OutcomeCube, with a normal-approximation CI as ci_calc.
+"""
+
+class OutcomeCube:
+    """
+    Reported and total counts for each outcome over every combination of the dimension levels,
+    with an extra ALL position on each dimension holding the rollup over it. Every slice is then
+    a single array lookup.
+
+    Example, for the sponsor status breakdowns:
+    cube = OutcomeCube.build(spon_results, ['sponsor_status', 'inferred'])
+    cube.query('euctr', sponsor_status='Commercial', inferred=0)
+    cube.table('ctgov', 'sponsor_status', inferred=1)
+    """
+
+    def __init__(self, dims, levels, outcomes, reported, total):
+        """
+        Use OutcomeCube.build or OutcomeCube.load rather than calling this directly.
+        Keyword arguments:
+        dims -- List of dimension names
+        levels -- List of arrays, the observed levels of each dimension
+        outcomes -- List of outcome names
+        reported, total -- Count arrays shaped (len(levels[0]) + 2, ..., len(outcomes)); on each
+        dimension the second-last position is missing values and the last is ALL
+        """
+        self.dims = list(dims)
+        self.levels = [np.asarray(lv) for lv in levels]
+        self.outcomes = list(outcomes)
+        self.reported = reported
+        self.total = total
+        self._positions = [{v: i for i, v in enumerate(lv.tolist())} for lv in self.levels]
+
+    @classmethod
+    def build(cls, df, dims, outcomes=OUTCOMES, eligible=REGISTRY_IDS):
+        """
+        Count the outcomes once over every dimension combination and roll them up.
+        Keyword arguments:
+        df -- One row per trial, e.g. spon_results or exploratory_final
+        dims -- List of columns to slice by, e.g. ['sponsor_status', 'inferred', 'sponsor_country']
+        outcomes -- Dict of outcome name to its 0/1 column. Default is OUTCOMES
+        eligible -- Dict of outcome name to a column that must be non-null for a trial to count towards
+        it, so registry rates are out of the trials registered there. Default is reporting.REGISTRY_IDS
+        """
+        codes, levels = [], []
+        for dim in dims:
+            c, lv = pd.factorize(df[dim], sort=True)
+            #Missing values go in the slot after the levels
+            codes.append(np.where(c == -1, len(lv), c))
+            levels.append(np.asarray(lv))
+        shape = tuple(len(lv) + 2 for lv in levels)
+        cell = np.ravel_multi_index(codes, shape) if dims else np.zeros(len(df), dtype=np.int64)
+        size = int(np.prod(shape))
+
+        reported = np.zeros(shape + (len(outcomes),), dtype=np.int64)
+        total = np.zeros_like(reported)
+        for k, (name, col) in enumerate(outcomes.items()):
+            counts = pd.Series(True, index=df.index)
+            if name in eligible and eligible[name] in df.columns:
+                counts = df[eligible[name]].notnull()
+            counts = counts.to_numpy()
+            hit = counts & (df[col].to_numpy() == 1)
+            total[..., k] = np.bincount(cell, weights=counts, minlength=size).reshape(shape)
+            reported[..., k] = np.bincount(cell, weights=hit, minlength=size).reshape(shape)
+
+        #Rolling up one axis at a time fills in every combination of ALL positions
+        for axis in range(len(dims)):
+            for arr in (reported, total):
+                target = [slice(None)] * arr.ndim
+                target[axis] = -1
+                source = list(target)
+                source[axis] = slice(None, -1)
+                arr[tuple(target)] = arr[tuple(source)].sum(axis=axis)
+        return cls(dims, levels, list(outcomes), reported, total)
+
+    def _position(self, axis, value):
+        if isinstance(value, str) and value == ALL:
+            return len(self.levels[axis]) + 1
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            return len(self.levels[axis])
+        try:
+            return self._positions[axis][value]
+        except KeyError:
+            raise KeyError(f'{value!r} is not a level of {self.dims[axis]!r}') from None
+
+    def _key(self, outcome, selection):
+        unknown = set(selection) - set(self.dims)
+        if unknown:
+            raise KeyError(f'No dimension(s) {sorted(unknown)}; the cube has {self.dims}')
+        if outcome not in self.outcomes:
+            raise KeyError(f'No outcome {outcome!r}; the cube has {self.outcomes}')
+        key = [self._position(axis, selection.get(dim, ALL)) for axis, dim in enumerate(self.dims)]
+        return tuple(key) + (self.outcomes.index(outcome),)
+
+    @staticmethod
+    def _cell(reported, total, z):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = np.where(total > 0, reported / np.maximum(total, 1), np.nan)
+            margin = z * np.sqrt(p * (1 - p) / np.maximum(total, 1))
+        return p, p - margin, p + margin
+
+    def query(self, outcome, z=1.96, **selection):
+        """
+        Counts, proportion and CI for one slice. Dimensions not given are rolled up (ALL);
+        pass None to select trials missing that dimension.
+        Keyword arguments:
+        outcome -- One of self.outcomes, e.g. 'euctr'
+        z -- z-value for the CI. Default 1.96 gives 95% CIs
+        Any other keyword arguments select a level of a dimension, e.g. sponsor_status='Commercial'
+        """
+        key = self._key(outcome, selection)
+        reported, total = int(self.reported[key]), int(self.total[key])
+        p, lower, upper = self._cell(reported, total, z)
+        return Cell(reported, total, float(p), float(lower), float(upper))
+
+    def table(self, outcome, by, z=1.96, **selection):
+        """
+        A query for every level of one dimension (plus missing, where there are any, and ALL), as a DataFrame
+        like crosstab's margins table with proportions and CIs added.
+        Keyword arguments:
+        outcome -- One of self.outcomes
+        by -- The dimension to break down by
+        z -- z-value for the CIs
+        Any other keyword arguments fix other dimensions, as for query
+        """
+        axis = self.dims.index(by)
+        key = list(self._key(outcome, selection))
+        key[axis] = slice(None)
+        reported, total = self.reported[tuple(key)], self.total[tuple(key)]
+        p, lower, upper = self._cell(reported, total, z)
+        labels = list(self.levels[axis]) + [np.nan, ALL]
+        out = pd.DataFrame({'reported': reported, 'total': total, 'proportion': p,
+                            'ci_lower': lower, 'ci_upper': upper}, index=pd.Index(labels, name=by))
+        if total[-2] == 0:
+            out = out.iloc[np.r_[:len(out) - 2, len(out) - 1]]
+        return out
+
+    def save(self, path):
+        """Write the cube to a .npz file, so it can be queried without the notebooks"""
+        #Text levels are stored as fixed-width strings so loading doesn't need pickle
+        arrays = {f'levels_{i}': lv.astype(str) if lv.dtype == object else lv for i, lv in enumerate(self.levels)}
+        np.savez_compressed(path, dims=np.array(self.dims), outcomes=np.array(self.outcomes),
+                            reported=self.reported, total=self.total, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Read a cube written by save"""
+        with np.load(path, allow_pickle=False) as f:
+            dims = f['dims'].tolist()
+            levels = [f[f'levels_{i}'] for i in range(len(dims))]
+            return cls(dims, levels, f['outcomes'].tolist(), f['reported'], f['total'])
+
+    def __repr__(self):
+        dims = ', '.join(f'{d} ({len(lv)})' for d, lv in zip(self.dims, self.levels))
+        return f'<OutcomeCube: {dims}; outcomes {self.outcomes}>'
@@ -0,0 +1,207 @@
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+#The top level of the repo, so paths below work from notebooks/ or anywhere else
+ROOT = Path(__file__).resolve().parents[1]
+
+Dataset = namedtuple('Dataset', ['path', 'columns', 'dates'])
+Dataset.__doc__ = """
+A CSV in the data folder.
+path -- Location relative to the repo root
+columns -- Dict of every column in the file, in file order, to the dtype it is read as. Date columns are read as text
+dates -- Dict of date column to the exact strftime format its values are stored in
+"""
+
+DMY_DATE = '%m/%d/%Y'
+ISO_DATE = '%Y-%m-%d'
+
+_search_columns = {
+    'euctr_id': 'object',
+    'dual_searched': 'int64',
+    'searched_by': 'object',
+    'senior_reviewed': 'float64',
+    'replaced': 'float64',
+    'replaced_reason': 'object',
+    'euctr_results': 'object',
+    'euctr_results_link': 'object',
+    'euctr_results_format': 'object',
+    'euctr_results_date': 'object',
+    'ctgov_xreg': 'object',
+    'nct_id': 'object',
+    'ctgov_results': 'object',
+    'ctgov_results_link': 'object',
+    'ctgov_results_date': 'object',
+    'isrctn_xreg': 'object',
+    'isrctn_id': 'object',
+    'isrctn_results': 'object',
+    'isrctn_results_type': 'object',
+    'isrctn_results_link': 'object',
+    'isrctn_additional_links': 'object',
+    'isrctn_results_date': 'object',
+    'journal_result': 'object',
+    'journal_link': 'object',
+    'journal_source': 'object',
+    'journal_match': 'object',
+    'journal_pub_date': 'object',
+    'journal_reg_numbers': 'object',
+    'main_result_abstract': 'float64',
+    'excluded_abstract': 'float64',
+    'discl_no_analysis': 'float64',
+    'team_discuss': 'object',
+    'additional_results_located': 'object',
+    'notes': 'object',
+}
+
+_search_dates = ['euctr_results_date', 'ctgov_results_date', 'isrctn_results_date', 'journal_pub_date']
+
+_inc_columns = {
+    'euctr_results_inc': 'int64',
+    'ctgov_results_inc': 'int64',
+    'isrctn_results_inc': 'int64',
+    'journal_results_inc': 'int64',
+}
+
+_sample_columns = {'Unnamed: 0': 'int64', 'eudract_number': 'object', 'final_date': 'object', 'inferred': 'int64'}
+
+_coding_columns = ['euctr_res_nd', 'euctr_res_2nd', 'nct_nd', 'nct_2nd', 'nct_match', 'isrctn_nd', 'isrctn_2nd',
+                   'pub_nd', 'pub_2nd', 'pub_match', 'pub_date_match', 'pub_reg_nd', 'pub_reg_2nd', 'pub_reg_match']
+
+DATASETS = {
+    #The searchers' data, with dates as typed into the spreadsheet
+    'final_dataset': Dataset('data/final_dataset/final_dataset.csv',
+                             _search_columns,
+                             dict.fromkeys(_search_dates, DMY_DATE)),
+    #The same after exclusions and with results inclusion flags, as saved by pandas
+    'analysis_df': Dataset('data/final_dataset/analysis_df.csv',
+                           {'Unnamed: 0': 'int64', **_search_columns, **_inc_columns, 'any_results_inc': 'int64'},
+                           dict.fromkeys(_search_dates, ISO_DATE)),
+    'manual_reg_data': Dataset('data/additional_data/manual_reg_data.csv',
+                               {'Timestamp': 'object', 'Trial Start Year': 'int64', 'Enrollment': 'int64',
+                                'Location': 'object', 'Notes': 'object', 'Trial ID': 'object'},
+                               {'Timestamp': '%m/%d/%Y %H:%M:%S'}),
+    'reg_spon_info': Dataset('data/additional_data/reg_spon_info.csv',
+                             {'Unnamed: 0': 'int64', 'trial_id': 'object', 'sponsor_status': 'object',
+                              'protocol_country': 'float64'},
+                             {}),
+    'spon_country_data': Dataset('data/additional_data/spon_country_data.csv',
+                                 {'Unnamed: 0': 'int64', 'trial_id': 'object', 'sponsor_status': 'object',
+                                  'protocol_country': 'float64', 'sponsor_country': 'object'},
+                                 {}),
+    #Hand corrections applied with lib.corrections.apply_corrections
+    'manual_corrections': Dataset('data/additional_data/manual_corrections.csv',
+                                  dict.fromkeys(['trial_id', 'field', 'old_value', 'new_value', 'reason'], 'object'),
+                                  {}),
+    'search_sample': Dataset('data/samples/euctr_search_sample_final.csv', _sample_columns, {'final_date': ISO_DATE}),
+    'replacement_sample': Dataset('data/samples/replacement_sample.csv', _sample_columns, {'final_date': ISO_DATE}),
+    'dual_coding': Dataset('data/dual_coding/dual_coding.csv',
+                           {'trial_id': 'object', 'second_coder': 'object', **dict.fromkeys(_coding_columns, 'float64')},
+                           {}),
+    'results_scrape': Dataset('data/source_data/euctr_data_quality_results_scrape_dec_2020.csv.zip',
+                              {'Unnamed: 0': 'int64', 'trial_id': 'object', 'global_end_of_trial_date': 'object',
+                               'first_version_date': 'object', 'this_version_date': 'object',
+                               'trial_countries': 'object', 'results_type': 'object',
+                               'recruitment_countries': 'object', 'trial_start_date': 'object', 'error': 'object'},
+                              dict.fromkeys(['global_end_of_trial_date', 'first_version_date',
+                                             'this_version_date', 'trial_start_date'], ISO_DATE)),
+    'protocols': Dataset('data/source_data/euctr_processed_dec2020.csv.zip',
+                         {'eudract_number_with_country': 'object',
+                          'date_of_competent_authority_decision': 'object',
+                          'end_of_trial_status': 'object',
+                          'eudract_number': 'object',
+                          'trial_in_the_member_state_concerned_years': 'float64',
+                          'trial_in_all_countries_concerned_by_the_trial_years': 'float64',
+                          'date_of_ethics_committee_opinion': 'object',
+                          'trial_in_all_countries_concerned_by_the_trial_months': 'float64',
+                          'trial_in_the_member_state_concerned_months': 'float64',
+                          'date_of_the_global_end_of_the_trial': 'object',
+                          'trial_in_the_member_state_concerned_days': 'float64',
+                          'trial_in_all_countries_concerned_by_the_trial_days': 'float64',
+                          'trial_results': 'object'},
+                         dict.fromkeys(['date_of_competent_authority_decision', 'date_of_ethics_committee_opinion',
+                                        'date_of_the_global_end_of_the_trial'], ISO_DATE)),
+    #Graphing data exported by the Analysis notebook
+    'time_to_pub': Dataset('data/graphing_data/time_to_pub.csv',
+                           {'Unnamed: 0.1': 'int64', 'euctr_id': 'object', 'euctr_results_inc': 'int64',
+                            'euctr_results_date': 'object', 'nct_id': 'object', 'ctgov_results_inc': 'int64',
+                            'ctgov_results_date': 'object', 'journal_results_inc': 'int64',
+                            'journal_pub_date': 'object', 'min_date': 'object', 'max_date': 'object',
+                            'results_counts': 'int64', 'earliest_results': 'object', 'Unnamed: 0': 'int64',
+                            'eudract_number': 'object', 'final_date': 'object', 'inferred': 'int64',
+                            'euctr_days': 'float64', 'ctg_days': 'float64', 'pub_days': 'float64'},
+                           dict.fromkeys(['euctr_results_date', 'ctgov_results_date', 'journal_pub_date',
+                                          'min_date', 'max_date', 'final_date'], ISO_DATE)),
+    'start_year_data': Dataset('data/graphing_data/start_year_data.csv',
+                               {'Unnamed: 0': 'int64', 'euctr_id': 'object', 'euctr_results_inc': 'int64',
+                                'any_results_inc': 'int64', 'Trial Start Year': 'int64'},
+                               {}),
+    'days_to_search': Dataset('data/graphing_data/days_to_search.csv',
+                              {'Unnamed: 0': 'int64', 'inferred': 'int64', 'days_to_search': 'float64'},
+                              {}),
+    'upset_data': Dataset('data/graphing_data/upset_data.csv',
+                          {'Unnamed: 0': 'int64', **_inc_columns},
+                          {}),
+    'upset_reg_data': Dataset('data/graphing_data/upset_reg_data.csv',
+                              {'Unnamed: 0': 'int64', 'euctr_id': 'object', 'nct_id': 'object', 'isrctn_id': 'object'},
+                              {}),
+}
+
+def _matches(value, fmt):
+    try:
+        datetime.strptime(value, fmt)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def parse_dates(values, fmt, name='values'):
+    """
+    Turn strings in a single known format into datetimes, raising on anything that doesn't match.
+    Each distinct string is parsed once and the results are mapped back, so the cost depends on
+    the number of distinct dates rather than the number of rows. Valid dates outside the range
+    pandas can represent become NaT.
+    Keyword arguments:
+    values -- A series or array of date strings, with missing values as NaN/None
+    fmt -- The exact strftime format, e.g. '%m/%d/%Y'
+    name -- What to call the values in the error message
+    """
+    codes, uniques = pd.factorize(values)
+    parsed = pd.to_datetime(uniques, format=fmt, errors='coerce')
+    #Real dates that datetime64[ns] can't hold (e.g. year 0210 typed for 2010) become NaT; depending on
+    #the pandas version they otherwise either fail to parse or wrap around when converted
+    parsed = parsed.where((parsed >= pd.Timestamp.min) & (parsed <= pd.Timestamp.max))
+    bad = np.array([pd.isna(p) and not _matches(u, fmt) for u, p in zip(uniques, parsed)], dtype=bool)
+    if bad.any():
+        examples = ', '.join(repr(v) for v in uniques[bad][:5])
+        raise ValueError(f'{name}: {bad.sum()} distinct value(s) do not match {fmt!r}, e.g. {examples}')
+    #factorize marks missing values with -1, which picks up the NaT appended on the end
+    out = np.append(parsed.values.astype('datetime64[ns]'), np.datetime64('NaT', 'ns'))[codes]
+    if isinstance(values, pd.Series):
+        return pd.Series(out, index=values.index, name=values.name)
+    return out
+
+def load_dataset(name, usecols=None, root=ROOT):
+    """
+    Load a dataset from the registry with declared dtypes and parsed dates.
+    Keyword arguments:
+    name -- A key of DATASETS
+    usecols -- Optional list of columns to read. Default is all of them
+    root -- The repo root to read from
+    """
+    spec = DATASETS[name]
+    path = Path(root) / spec.path
+    header = list(pd.read_csv(path, nrows=0).columns)
+    if header != list(spec.columns):
+        missing = [c for c in spec.columns if c not in header]
+        extra = [c for c in header if c not in spec.columns]
+        raise ValueError(f'{spec.path} does not match the {name!r} schema: missing {missing}, unexpected {extra}')
+    if usecols is not None:
+        unknown = [c for c in usecols if c not in spec.columns]
+        if unknown:
+            raise KeyError(f'{name!r} has no column(s) {unknown}')
+    df = pd.read_csv(path, dtype=spec.columns, usecols=usecols)
+    for col, fmt in spec.dates.items():
+        if col in df.columns:
+            df[col] = parse_dates(df[col], fmt, f'{name}.{col}')
+    return df
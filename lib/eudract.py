@@ -0,0 +1,135 @@
+import pandas as pd
+import numpy as np
+
+#Packed value of a missing or (with errors='coerce') malformed ID
+MISSING = -1
+
+_DIGITS = [0, 1, 2, 3, 5, 6, 7, 8, 9, 10, 12, 13]
+_DASHES = [4, 11]
+_WEIGHTS = 10 ** np.arange(11, -1, -1, dtype=np.int64)
+
+def _as_bytes(values):
+    s = pd.Series(values, copy=False)
+    missing = s.isna().to_numpy()
+    filled = s.where(~missing, '').astype(str).to_numpy()
+    try:
+        #One byte wider than an ID, so anything too long shows up as a non-zero last byte
+        raw = filled.astype('S15')
+    except UnicodeEncodeError:
+        raw = np.array([v.encode('ascii', 'replace') for v in filled], dtype='S15')
+    return raw.view(np.uint8).reshape(len(raw), 15), missing
+
+def _valid(b):
+    digits = b[:, _DIGITS]
+    return ((b[:, 14] == 0) & (b[:, _DASHES] == ord('-')).all(axis=1) &
+            ((digits >= ord('0')) & (digits <= ord('9'))).all(axis=1))
+
+def is_eudract(values):
+    """
+    Boolean array saying which values are well-formed EudraCT numbers (YYYY-NNNNNN-CC).
+    Keyword arguments:
+    values -- A series, array or list of strings
+    """
+    b, missing = _as_bytes(values)
+    return ~missing & _valid(b)
+
+def encode_eudract(values, errors='raise'):
+    """
+    Pack EudraCT numbers into int64 (YYYY-NNNNNN-CC becomes the integer YYYYNNNNNNCC), losslessly.
+    Missing values become MISSING (-1).
+    Keyword arguments:
+    values -- A series, array or list of strings
+    errors -- 'raise' (default) to fail on malformed IDs, or 'coerce' to pack them as MISSING
+    """
+    b, missing = _as_bytes(values)
+    valid = _valid(b)
+    bad = ~valid & ~missing
+    if bad.any() and errors == 'raise':
+        examples = ', '.join(repr(v) for v in pd.Series(values, copy=False)[bad].head(5))
+        raise ValueError(f'{bad.sum()} value(s) are not EudraCT numbers (YYYY-NNNNNN-CC), e.g. {examples}')
+    packed = (b[:, _DIGITS].astype(np.int64) - ord('0')) @ _WEIGHTS
+    packed[~valid] = MISSING
+    if isinstance(values, pd.Series):
+        return pd.Series(packed, index=values.index, name=values.name)
+    return packed
+
+def decode_eudract(packed):
+    """
+    Unpack int64 values from encode_eudract back to 'YYYY-NNNNNN-CC' strings, with NaN for MISSING.
+    Keyword arguments:
+    packed -- A series or array of packed IDs
+    """
+    codes = np.asarray(packed, dtype=np.int64)
+    b = np.full((len(codes), 14), ord('-'), dtype=np.uint8)
+    b[:, _DIGITS] = (codes[:, None] // _WEIGHTS % 10 + ord('0')).astype(np.uint8)
+    out = b.view('S14').ravel().astype('U14').astype(object)
+    out[codes == MISSING] = np.nan
+    if isinstance(packed, pd.Series):
+        return pd.Series(out, index=packed.index, name=packed.name)
+    return out
+
+def _packed(values):
+    if isinstance(values, (set, frozenset)):
+        values = list(values)
+    arr = np.asarray(values)
+    if np.issubdtype(arr.dtype, np.integer):
+        return arr.astype(np.int64)
+    return np.asarray(encode_eudract(values, errors='coerce'))
+
+def eudract_isin(values, ids):
+    """
+    Packed-key equivalent of values.isin(ids) for EudraCT numbers.
+    Keyword arguments:
+    values -- A series or array of IDs, as strings or already packed
+    ids -- A list-like or set of the IDs to test membership of, as strings or already packed
+    """
+    right = _packed(ids)
+    out = np.isin(_packed(values), right[right != MISSING])
+    if isinstance(values, pd.Series):
+        return pd.Series(out, index=values.index, name=values.name)
+    return out
+
+def _merge_keys(left, right):
+    #Packed keys for both sides of a merge. Values that don't pack (missing or malformed) would all
+    #be MISSING and join to each other, so they are keyed by their own value instead, as negative
+    #codes shared across both sides: identical strings still join, and missing joins missing, as in
+    #pd.merge on the strings
+    keys = [np.array(_packed(left), dtype=np.int64), np.array(_packed(right), dtype=np.int64)]
+    odd = [k == MISSING for k in keys]
+    if any(o.any() for o in odd):
+        values = pd.concat([pd.Series(np.asarray(v, dtype=object)[o]) for v, o in zip((left, right), odd)],
+                           ignore_index=True)
+        codes, _ = pd.factorize(values)
+        codes = np.where(codes < 0, -2, -3 - codes)
+        split = odd[0].sum()
+        keys[0][odd[0]] = codes[:split]
+        keys[1][odd[1]] = codes[split:]
+    return keys
+
+def merge_on_eudract(left, right, left_on, right_on=None, how='left', drop_right_key=True, **kwargs):
+    """
+    pd.merge on EudraCT numbers, joined on packed int64 keys rather than strings. Missing and
+    malformed IDs join as they would as strings: to identical values only.
+    Keyword arguments:
+    left, right -- DataFrames to merge
+    left_on -- The left ID column, e.g. 'euctr_id'
+    right_on -- The right ID column, e.g. 'eudract_number'. Default is left_on
+    how -- As for pd.merge. Default is 'left'
+    drop_right_key -- Drop right_on from the result, as the notebooks do after merging. It is always
+    dropped when it has the same name as left_on, which then holds the ID for every row
+    Any other keyword arguments go to pd.merge.
+    """
+    right_on = right_on or left_on
+    key, right_id = '_eudract_key', '_eudract_right_id'
+    left_keys, right_keys = _merge_keys(left[left_on], right[right_on])
+    left = left.assign(**{key: left_keys})
+    right = right.assign(**{key: right_keys})
+    if how in ('right', 'outer'):
+        right = right.assign(**{right_id: right[right_on]})
+    if drop_right_key or right_on == left_on:
+        right = right.drop(columns=right_on)
+    merged = left.merge(right, on=key, how=how, **kwargs)
+    if how in ('right', 'outer'):
+        merged[left_on] = merged[left_on].where(merged[left_on].notna(), merged[right_id])
+        merged = merged.drop(columns=right_id)
+    return merged.drop(columns=key)
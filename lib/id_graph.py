@@ -0,0 +1,159 @@
+import pandas as pd
+import numpy as np
+
+from lib.registry_ids import REGISTRIES, registry_of
+
+LINK_COLUMNS = ['id_a', 'id_b', 'source']
+
+def links_from_columns(df, key, columns, source=None, sep=None):
+    """
+    (id_a, id_b, source) links from a key column to each ID in one or more ID columns.
+    Keyword arguments:
+    df -- DataFrame with the key and ID columns, e.g. analysis_df
+    key -- Column with the record's own ID, e.g. 'euctr_id'
+    columns -- Column or list of columns of linked IDs, e.g. ['nct_id', 'isrctn_id']
+    source -- Label for the links. Default is each column's name
+    sep -- Optional separator for columns holding several IDs, e.g. CT.gov secondary IDs
+    """
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    parts = []
+    for col in columns:
+        linked = df[[key, col]].dropna()
+        if sep is not None:
+            linked = linked.assign(**{col: linked[col].astype(str).str.split(sep)}).explode(col)
+        linked = linked[linked[col].astype(str).str.strip() != '']
+        parts.append(pd.DataFrame({'id_a': linked[key].to_numpy(), 'id_b': linked[col].astype(str).str.strip().to_numpy(),
+                                   'source': source or col}))
+    return pd.concat(parts, ignore_index=True)
+
+def links_from_extracted(ids, key, source=None):
+    """
+    Links from the output of lib.registry_ids.extract_ids, between each record's key and the valid IDs found for it.
+    Keyword arguments:
+    ids -- extract_ids output, with the key column carried through
+    key -- The key column, e.g. 'euctr_id'
+    source -- Label for the links. Default is the field each ID was found in
+    """
+    ids = ids[ids.valid]
+    return pd.DataFrame({'id_a': ids[key].to_numpy(), 'id_b': ids.id.to_numpy(),
+                         'source': source or ids.field.to_numpy()})
+
+def _union_find(a, b, n):
+    #Union-find over whole arrays of edges at once: each pass hooks the larger root of every
+    #unjoined edge onto the smaller, then compresses paths fully, so parent is always a root
+    parent = np.arange(n)
+    while True:
+        ra, rb = parent[a], parent[b]
+        apart = ra != rb
+        if not apart.any():
+            return parent
+        np.minimum.at(parent, np.maximum(ra, rb)[apart], np.minimum(ra, rb)[apart])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+class IdGraph:
+    """
+    Trial IDs from any registry clustered by the links between them, so that every ID a trial is
+    known by, directly or through a chain of links, falls in one cluster.
+    Clusters are numbered from 0 in order of their first ID's first appearance in the links.
+
+    Example:
+    a = load_dataset('analysis_df')
+    graph = IdGraph(links_from_columns(a, 'euctr_id', ['nct_id', 'isrctn_id']))
+    graph.members('NCT02269488')
+    graph.coverage().query('nct > 1')
+    """
+
+    def __init__(self, links):
+        """
+        Keyword arguments:
+        links -- DataFrame, or list of DataFrames, with id_a, id_b and source columns
+        """
+        if not isinstance(links, pd.DataFrame):
+            links = pd.concat(list(links), ignore_index=True)
+        missing = [c for c in LINK_COLUMNS if c not in links.columns]
+        if missing:
+            raise KeyError(f'Links need column(s) {missing}')
+        links = links[LINK_COLUMNS].dropna(subset=['id_a', 'id_b'])
+        #IDs are hashed once, and repeated links dropped by their codes rather than their strings
+        codes, ids = pd.factorize(np.concatenate([links.id_a.to_numpy(dtype=object), links.id_b.to_numpy(dtype=object)]))
+        source, _ = pd.factorize(links.source)
+        keep = ~pd.DataFrame({'a': codes[:len(links)], 'b': codes[len(links):], 's': source}).duplicated().to_numpy()
+        links = links[keep].reset_index(drop=True)
+        a, b = codes[:len(keep)][keep], codes[len(keep):][keep]
+        roots = _union_find(a, b, len(ids))
+        #Roots are the smallest code in each cluster, so factorizing them numbers clusters in order
+        cluster, _ = pd.factorize(roots)
+
+        self.ids = pd.Index(ids, name='id')
+        self.registry = registry_of(ids)
+        self.cluster = cluster
+        self.links = links.assign(cluster=cluster[a])
+        self.n_clusters = int(cluster.max()) + 1 if len(cluster) else 0
+        #Members of each cluster laid out contiguously, CSR style, for lookup without a scan
+        self._order = np.argsort(cluster, kind='stable')
+        self._indptr = np.concatenate([[0], np.cumsum(np.bincount(cluster, minlength=self.n_clusters))])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f'IdGraph({len(self.ids)} ids, {len(self.links)} links, {self.n_clusters} clusters)'
+
+    def union(self, links):
+        """A new graph with these links added to this one's"""
+        return IdGraph([self.links[LINK_COLUMNS], links])
+
+    def cluster_of(self, ids):
+        """Cluster number of each ID, or -1 for IDs not in the graph"""
+        scalar = isinstance(ids, str)
+        positions = self.ids.get_indexer([ids] if scalar else ids)
+        found = np.where(positions >= 0, self.cluster[positions], -1)
+        return int(found[0]) if scalar else found
+
+    def members(self, id_or_cluster):
+        """
+        Every ID in a cluster, with its registry.
+        Keyword arguments:
+        id_or_cluster -- An ID in the cluster, or a cluster number
+        """
+        c = self.cluster_of(id_or_cluster) if isinstance(id_or_cluster, str) else int(id_or_cluster)
+        if c < 0:
+            raise KeyError(id_or_cluster)
+        rows = self._order[self._indptr[c]:self._indptr[c + 1]]
+        return pd.DataFrame({'id': self.ids[rows], 'registry': self.registry[rows]})
+
+    def same_cluster(self, a, b):
+        """Whether each pair of IDs is linked, directly or not. IDs not in the graph are linked to nothing"""
+        ca, cb = self.cluster_of(a), self.cluster_of(b)
+        return (ca == cb) & (np.asarray(ca) >= 0)
+
+    def clusters(self):
+        """One row per ID: id, registry and cluster"""
+        return pd.DataFrame({'id': self.ids, 'registry': self.registry, 'cluster': self.cluster})
+
+    def coverage(self):
+        """
+        One row per cluster: number of IDs from each registry (and other), total IDs, number of
+        links, and a tuple of the sources the links came from.
+        """
+        labels = REGISTRIES + ['other']
+        codes = pd.Categorical(self.registry, categories=labels).codes
+        flat = np.bincount(self.cluster * len(labels) + codes, minlength=self.n_clusters * len(labels))
+        counts = flat.reshape(self.n_clusters, len(labels))
+        out = pd.DataFrame(counts, columns=labels, index=pd.RangeIndex(self.n_clusters, name='cluster'))
+        out['ids'] = counts.sum(axis=1)
+        out['links'] = np.bincount(self.links.cluster.to_numpy(), minlength=self.n_clusters)
+        #Sources are gathered as a bitmask per cluster, then each distinct mask spelled out once
+        codes, sources = pd.factorize(self.links.source, sort=True)
+        if len(sources) > 63:
+            raise ValueError(f'coverage handles up to 63 link sources, not {len(sources)}')
+        masks = np.zeros(self.n_clusters, dtype=np.int64)
+        np.bitwise_or.at(masks, self.links.cluster.to_numpy(), np.left_shift(1, codes.astype(np.int64)))
+        distinct, inverse = np.unique(masks, return_inverse=True)
+        spelled = [tuple(sources[[k for k in range(len(sources)) if m >> k & 1]]) for m in distinct]
+        out['sources'] = pd.Series(spelled, dtype=object).to_numpy()[inverse]
+        return out
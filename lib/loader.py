@@ -0,0 +1,66 @@
+import argparse
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from lib.datasets import load_dataset
+
+#What the Analysis notebook's setup cell reads, under the names it uses for them
+ANALYSIS_INPUTS = {
+    'df': 'final_dataset',
+    'regression': 'manual_reg_data',
+    'other_reg_data': 'spon_country_data',
+    'sample': 'search_sample',
+    'replacements': 'replacement_sample',
+    'dec_results': 'results_scrape',
+}
+
+def _load(name, kwargs, loader, origin):
+    start = time.perf_counter()
+    df = loader(name, **kwargs)
+    end = time.perf_counter()
+    return df, start - origin, end - start
+
+def load_bundle(manifest, max_workers=None, loader=load_dataset):
+    """
+    Load several datasets at once on a thread pool. Decompression and parsing release the GIL
+    for much of the work, so the wall time is close to that of the largest file.
+    Returns (bundle, timings): a namedtuple with a field per manifest entry, and a DataFrame with
+    each file's start offset, load time and row count in seconds.
+    Keyword arguments:
+    manifest -- Dict of field name to dataset name, or to (dataset name, dict of keyword arguments
+    for the loader), e.g. ANALYSIS_INPUTS or {'protocols': ('protocols', {'usecols': [...]})}.
+    A list of dataset names uses them as the field names
+    max_workers -- Threads to use. Default is one per dataset
+    loader -- Called as loader(dataset name, **kwargs). Default is lib.datasets.load_dataset
+    """
+    if not isinstance(manifest, dict):
+        manifest = {name: name for name in manifest}
+    jobs = {field: (spec, {}) if isinstance(spec, str) else spec for field, spec in manifest.items()}
+    origin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers or len(jobs)) as pool:
+        futures = {field: pool.submit(_load, name, kwargs, loader, origin) for field, (name, kwargs) in jobs.items()}
+        results = {field: future.result() for field, future in futures.items()}
+    Bundle = namedtuple('Bundle', list(results))
+    bundle = Bundle(**{field: df for field, (df, _, _) in results.items()})
+    timings = pd.DataFrame({'dataset': [jobs[f][0] for f in results],
+                            'started': [r[1] for r in results.values()],
+                            'seconds': [r[2] for r in results.values()],
+                            'rows': [len(r[0]) for r in results.values()]},
+                           index=pd.Index(list(results), name='field'))
+    timings.attrs['wall_seconds'] = time.perf_counter() - origin
+    return bundle, timings
+
+def main():
+    parser = argparse.ArgumentParser(description='Load datasets concurrently and report how long each took')
+    parser.add_argument('datasets', nargs='*', help='Dataset names. Default is what the Analysis notebook reads')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    _, timings = load_bundle(args.datasets or ANALYSIS_INPUTS, args.workers)
+    print(timings.round(3).to_string())
+    print(f"Total {timings.attrs['wall_seconds']:.3f}s wall, {timings.seconds.sum():.3f}s summed")
+
+if __name__ == '__main__':
+    main()
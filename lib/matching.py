@@ -0,0 +1,198 @@
+from collections import namedtuple
+
+import pandas as pd
+import numpy as np
+
+from lib.datasets import load_dataset
+from lib.id_graph import links_from_columns
+
+#Words too common in trial titles to say anything about which trial it is
+STOPWORDS = frozenset('''
+a an and are as at be by for from in into is of on or the to versus vs with without
+study trial phase randomised randomized controlled double blind blinded open label placebo
+multicentre multicenter patients subjects efficacy safety evaluate evaluation effect effects
+'''.split())
+
+#Company and institution suffixes dropped from sponsor names
+SPONSOR_SUFFIXES = frozenset('''
+ltd limited inc incorporated corp corporation co company plc llc lp gmbh ag kg sa sas spa srl bv nv ab as oy
+'''.split())
+
+Signatures = namedtuple('Signatures', ['ids', 'matrix'])
+Signatures.__doc__ = """
+MinHash signatures of a set of trial records, from signatures.
+ids -- Array of record IDs labelling the rows. Records with no tokens are left out
+matrix -- uint32 array of shape (len(ids), num_perm), the minimum of each hash permutation over a record's tokens
+"""
+
+def _words(text, drop):
+    #Lower case ASCII words, one row per word with the record's position and the word's place in it
+    text = (text.fillna('').astype(str).str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+            .str.lower().str.replace(r'[^a-z0-9]+', ' ', regex=True).str.split())
+    words = text.explode().dropna()
+    words = words[~words.isin(drop)]
+    record = words.index.to_numpy()
+    return pd.DataFrame({'record': record, 'word': words.to_numpy()})
+
+def record_tokens(records, title='title', sponsor='sponsor', dates=None):
+    """
+    The tokens MinHash signatures are built over, one row per record position and token.
+    Title words and word pairs, sponsor name words, and the year and month of each date, each
+    tagged with what it is so a word in a title never matches the same word in a sponsor name.
+    Keyword arguments:
+    records -- DataFrame of trials from one registry
+    title -- Title column
+    sponsor -- Sponsor name column, or None
+    dates -- Optional dict of a common label to this registry's date column, e.g. {'start': 'trial_start_date'},
+    so that dates from different registries with the same label are compared
+    """
+    records = records.reset_index(drop=True)
+    parts = []
+    words = _words(records[title], STOPWORDS)
+    following = words.word.shift(-1)
+    same = words.record.shift(-1).eq(words.record).to_numpy()
+    parts.append(pd.DataFrame({'record': words.record, 'token': 't:' + words.word}))
+    parts.append(pd.DataFrame({'record': words.record[same], 'token': 't:' + words.word[same] + ' ' + following[same]}))
+    if sponsor is not None:
+        names = _words(records[sponsor], SPONSOR_SUFFIXES)
+        parts.append(pd.DataFrame({'record': names.record, 'token': 's:' + names.word}))
+    for label, col in (dates or {}).items():
+        when = pd.to_datetime(records[col], errors='coerce').dropna()
+        parts.append(pd.DataFrame({'record': when.index.to_numpy(), 'token': f'd:{label}:' + when.dt.strftime('%Y-%m')}))
+    tokens = pd.concat(parts, ignore_index=True).drop_duplicates()
+    return tokens.sort_values('record', kind='stable').reset_index(drop=True)
+
+def minhash(tokens, n_records, num_perm=128, seed=0, chunk=1 << 16):
+    """
+    MinHash signature of each record's token set.
+    Tokens are hashed with pandas' stable string hash, so signatures made separately for two
+    registries with the same num_perm and seed can be compared.
+    Returns a uint32 array of shape (n_records, num_perm); rows for records with no tokens are all 2**32 - 1.
+    Keyword arguments:
+    tokens -- DataFrame from record_tokens, sorted by record
+    n_records -- Number of records
+    num_perm -- Number of hash permutations. More gives finer similarity estimates
+    seed -- Seed for the permutations
+    chunk -- Tokens hashed at a time, which bounds memory to about chunk * num_perm * 12 bytes
+    """
+    #Multiply-shift hashing: the high 32 bits of a * x + b, wrapping mod 2**64, with a odd. Each
+    #permutation is a row, so every record's run of tokens is contiguous for reduceat
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)[:, None] * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)[:, None]
+    hashed = pd.util.hash_array(tokens.token.to_numpy(dtype=object)) >> np.uint64(32)
+    record = tokens.record.to_numpy()
+    out = np.full((num_perm, n_records), np.iinfo(np.uint32).max, dtype=np.uint32)
+    for start in range(0, len(hashed), chunk):
+        h = hashed[start:start + chunk]
+        r = record[start:start + chunk]
+        values = ((a * h + b) >> np.uint64(32)).astype(np.uint32)
+        #Tokens are grouped by record, so each record's minimum is one reduceat over its run. A
+        #record split across chunks is finished by the minimum with what the last chunk left
+        starts = np.flatnonzero(np.concatenate([[True], r[1:] != r[:-1]]))
+        rows = r[starts]
+        out[:, rows] = np.minimum(out[:, rows], np.minimum.reduceat(values, starts, axis=1))
+    return np.ascontiguousarray(out.T)
+
+def signatures(records, id='id', title='title', sponsor='sponsor', dates=None, num_perm=128, seed=0):
+    """
+    MinHash signatures for a registry's trials. Arguments are as for record_tokens and minhash,
+    with id the column of trial IDs.
+    """
+    tokens = record_tokens(records, title, sponsor, dates)
+    matrix = minhash(tokens, len(records), num_perm, seed)
+    has_tokens = np.zeros(len(records), dtype=bool)
+    has_tokens[tokens.record.to_numpy()] = True
+    return Signatures(records[id].to_numpy()[has_tokens], matrix[has_tokens])
+
+def _band_keys(matrix, bands, seed):
+    #One 64 bit key per record per band, from the band's rows mixed with odd multipliers
+    rows = matrix.shape[1] // bands
+    mult = np.random.default_rng(seed).integers(1, 1 << 63, rows, dtype=np.uint64) | np.uint64(1)
+    keys = np.empty((len(matrix), bands), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for k in range(bands):
+            block = matrix[:, k * rows:(k + 1) * rows].astype(np.uint64)
+            keys[:, k] = (block * mult).sum(axis=1) + np.uint64(k)
+    return keys
+
+def similarity(left, right, i, j, chunk=1 << 16):
+    """Estimated Jaccard similarity of left rows i and right rows j: the share of permutations whose minimum agrees"""
+    out = np.empty(len(i))
+    for start in range(0, len(i), chunk):
+        stop = start + chunk
+        out[start:stop] = (left.matrix[i[start:stop]] == right.matrix[j[start:stop]]).mean(axis=1)
+    return out
+
+def candidates(left, right, bands=32, max_bucket=1000, min_score=0.0, seed=0):
+    """
+    Candidate pairs of records from two registries by locality-sensitive hashing: signatures are
+    cut into bands and records sharing any band's values are paired, so only pairs likely to be
+    similar are ever scored. With 128 permutations in 32 bands, pairs with similarity 0.5 are
+    found 87% of the time and pairs with similarity 0.2 about 5%.
+    Returns a DataFrame with id_left, id_right, bands (number shared) and score, best first.
+    Keyword arguments:
+    left -- Signatures of one registry, e.g. the EUCTR
+    right -- Signatures of the other, made with the same num_perm and seed
+    bands -- Number of bands; must divide num_perm. More bands find less similar pairs at more cost
+    max_bucket -- Buckets pairing more than this many records are skipped, e.g. from a common boilerplate title
+    min_score -- Pairs scoring below this are dropped
+    seed -- Seed for the band keys
+    """
+    if left.matrix.shape[1] != right.matrix.shape[1] or left.matrix.shape[1] % bands:
+        raise ValueError(f'Both signatures need the same num_perm, divisible by bands={bands}')
+    lkeys, rkeys = _band_keys(left.matrix, bands, seed), _band_keys(right.matrix, bands, seed)
+    found = []
+    for k in range(bands):
+        l = pd.DataFrame({'key': lkeys[:, k], 'i': np.arange(len(lkeys))})
+        r = pd.DataFrame({'key': rkeys[:, k], 'j': np.arange(len(rkeys))})
+        sizes = l.key.value_counts().mul(r.key.value_counts(), fill_value=0)
+        shared = sizes.index[(sizes > 0) & (sizes <= max_bucket)]
+        pairs = l[l.key.isin(shared)].merge(r[r.key.isin(shared)], on='key')
+        found.append(pairs.i.to_numpy(dtype=np.int64) * len(rkeys) + pairs.j.to_numpy(dtype=np.int64))
+    pair, shared = np.unique(np.concatenate(found), return_counts=True)
+    i, j = pair // len(rkeys), pair % len(rkeys)
+    score = similarity(left, right, i, j)
+    out = pd.DataFrame({'id_left': left.ids[i], 'id_right': right.ids[j], 'bands': shared, 'score': score})
+    out = out[out.score >= min_score]
+    return out.sort_values(['score', 'bands'], ascending=False, kind='stable').reset_index(drop=True)
+
+def confirmed_links(final=None, registry='nct_id'):
+    """
+    The cross-registrations the searchers confirmed by hand, as (euctr_id, other ID) pairs.
+    Keyword arguments:
+    final -- The final dataset. Default is to load it
+    registry -- 'nct_id' or 'isrctn_id'
+    """
+    final = load_dataset('final_dataset') if final is None else final
+    links = links_from_columns(final, 'euctr_id', registry)
+    return links.rename(columns={'id_a': 'id_left', 'id_b': 'id_right'})[['id_left', 'id_right']]
+
+def evaluate(found, truth, left, right, thresholds=(0.0, 0.2, 0.3, 0.4, 0.5, 0.6)):
+    """
+    How well candidates recover known links, at each score threshold. Only known links whose
+    records both have signatures count, so missing dump coverage isn't scored as missed matches.
+    Returns a DataFrame by threshold with candidates, true positives, recall, precision (of
+    candidates involving a record with a known link) and the share of all pairs scored.
+    Keyword arguments:
+    found -- Output of candidates
+    truth -- Known links with id_left and id_right, e.g. confirmed_links()
+    left -- The left Signatures passed to candidates
+    right -- The right Signatures passed to candidates
+    thresholds -- Scores to report at
+    """
+    truth = truth[truth.id_left.isin(left.ids) & truth.id_right.isin(right.ids)].drop_duplicates()
+    labelled = found[found.id_left.isin(truth.id_left)]
+    hit = labelled.merge(truth.assign(known=True), on=['id_left', 'id_right'], how='left').known.fillna(False)
+    hit = hit.to_numpy(dtype=bool)
+    rows = []
+    for t in thresholds:
+        keep = (labelled.score >= t).to_numpy()
+        tp = int(hit[keep].sum())
+        rows.append({'threshold': t, 'candidates': int((found.score >= t).sum()), 'true_positives': tp,
+                     'recall': tp / len(truth) if len(truth) else np.nan,
+                     'precision': tp / keep.sum() if keep.sum() else np.nan})
+    out = pd.DataFrame(rows).set_index('threshold')
+    out['pairs_scored'] = len(found) / (len(left.ids) * len(right.ids))
+    out.attrs['known_links'] = len(truth)
+    return out
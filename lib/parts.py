@@ -0,0 +1,120 @@
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from pathlib import Path
+
+import pyarrow as pa
+
+from lib.arrow_csv import read_batches, read_table
+from lib.datasets import ROOT
+
+class PartedDataset:
+    """
+    A dataset split over several CSV (or zipped CSV) files with the same columns, e.g. the raw dump
+    split into pieces small enough to commit. Parts are read one at a time, or concurrently for
+    aggregations, so a concatenated copy is never built unless to_frame is asked for.
+
+    Example:
+    dump = PartedDataset.from_manifest('data/source_data/euctr_dump.parts', 'protocols')
+    statuses = dump.aggregate(lambda df: df.end_of_trial_status.value_counts(),
+                              lambda a, b: a.add(b, fill_value=0))
+    """
+
+    def __init__(self, parts, schema, root=ROOT):
+        """
+        Keyword arguments:
+        parts -- List of part files, in order, relative to root or absolute
+        schema -- The lib.datasets.DATASETS name whose columns and types the parts have, e.g. 'protocols'
+        root -- The repo root
+        """
+        self.parts = [Path(root) / p for p in parts]
+        self.schema = schema
+        missing = [str(p) for p in self.parts if not p.exists()]
+        if missing:
+            raise FileNotFoundError(f'Missing part(s): {missing}')
+
+    @classmethod
+    def from_manifest(cls, manifest, schema, root=ROOT):
+        """
+        Read the list of parts from a manifest file: one file name per line, relative to the manifest,
+        as written by write_parts.
+        """
+        manifest = Path(root) / manifest
+        names = [line.strip() for line in manifest.read_text().splitlines() if line.strip()]
+        return cls([manifest.parent / n for n in names], schema, root)
+
+    def batches(self, columns=None):
+        """Arrow record batches from every part in order"""
+        for part in self.parts:
+            yield from read_batches(self.schema, columns, path=part)
+
+    def frames(self, columns=None):
+        """Each part in turn as a DataFrame"""
+        for part in self.parts:
+            yield read_table(self.schema, columns, path=part).to_pandas()
+
+    def aggregate(self, func, combine, columns=None, max_workers=None):
+        """
+        Apply func to each part's DataFrame on a thread pool and fold the results together with combine.
+        Only max_workers parts are held in memory at once.
+        Keyword arguments:
+        func -- Called with each part's DataFrame; returns a partial result
+        combine -- Called with two partial results; returns their combination
+        columns -- Optional list of columns to read
+        max_workers -- Threads to use. Default is one per part, up to 4
+        """
+        def run(part):
+            return func(read_table(self.schema, columns, path=part).to_pandas())
+
+        with ThreadPoolExecutor(max_workers or min(4, len(self.parts))) as pool:
+            return reduce(combine, pool.map(run, self.parts))
+
+    def to_frame(self, columns=None):
+        """
+        The whole dataset as one DataFrame. The parts are joined as Arrow tables, which only links their
+        buffers together, so each output column is allocated once on conversion rather than once per
+        part and again for pd.concat.
+        """
+        return pa.concat_tables(read_table(self.schema, columns, path=p) for p in self.parts).to_pandas()
+
+def write_parts(df, directory, stem, max_bytes=50 * 1024 ** 2, chunksize=5000):
+    """
+    Write a DataFrame as zipped CSV parts of up to about max_bytes each, plus a manifest listing them.
+    A part is closed when the next chunk looks likely to take it over max_bytes, judged from the
+    compressed size of the chunks so far, so keep chunks small relative to max_bytes.
+    Returns the manifest path, which PartedDataset.from_manifest reads.
+    Keyword arguments:
+    df -- The data
+    directory -- Where to write the parts and manifest
+    stem -- File name stem; parts are <stem>_part<n>.csv.zip and the manifest <stem>.parts
+    max_bytes -- Size each compressed part is capped at. Default 50MB, under GitHub's warning size
+    chunksize -- Rows written at a time
+    """
+    directory = Path(directory)
+    header = df.iloc[:0].to_csv(index=False).encode()
+    names, part, member, f = [], None, None, None
+    growth = 0
+    for start in range(0, len(df), chunksize):
+        #Deflate holds output back, so the last chunk's growth is the guide to whether the next one fits
+        if part is not None and f.tell() + 2 * growth > max_bytes:
+            member.close()
+            part.close()
+            f.close()
+            part = None
+        if part is None:
+            name = f'{stem}_part{len(names) + 1}.csv.zip'
+            f = open(directory / name, 'wb')
+            part = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
+            member = part.open(name[:-len('.zip')], 'w', force_zip64=True)
+            member.write(header)
+            names.append(name)
+        before = f.tell()
+        member.write(df.iloc[start:start + chunksize].to_csv(index=False, header=False).encode())
+        growth = max(growth, f.tell() - before)
+    if part is not None:
+        member.close()
+        part.close()
+        f.close()
+    manifest = directory / f'{stem}.parts'
+    manifest.write_text(''.join(f'{n}\n' for n in names))
+    return manifest
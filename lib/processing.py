@@ -0,0 +1,86 @@
+import pandas as pd
+import numpy as np
+
+#Statuses meaning a country protocol never started
+NOT_STARTED = ['Not Authorised', 'Prohibited by CA']
+
+_NAT = np.iinfo(np.int64).min
+
+def _dates(series):
+    #A view of the nanosecond values, with NaT as the smallest int64 so it loses every max
+    return series.to_numpy(dtype='datetime64[ns]', copy=False).view(np.int64)
+
+def _group_max(codes, values, n, mask, fill):
+    out = np.full(n, fill, dtype=values.dtype)
+    np.maximum.at(out, codes[mask], values[mask])
+    return out
+
+def _duration_days(protocols, kind, rows):
+    days = np.zeros(rows.sum())
+    for unit, factor in (('years', 364), ('months', 30), ('days', 1)):
+        days += np.nan_to_num(protocols[f'trial_in_{kind}_{unit}'].to_numpy()[rows]) * factor
+    return days
+
+def trial_population(protocols, results, valid_from='2004-01-01', valid_to='2020-12-31',
+                     completed_before='2018-12-01'):
+    """
+    The Data Processing notebook's pipeline as whole-column operations: one row per trial with
+    its extracted or inferred completion date, exclusion status and inclusion flag.
+    Each stage works on an integer trial code per protocol and boolean masks over protocols or
+    trials, reading columns as views; the only subsets taken are of the few columns a stage uses,
+    and the per-trial frame is built once at the end.
+    Keyword arguments:
+    protocols -- The country-protocol scrape (one row per eudract_number_with_country) with dates parsed
+    results -- The results section scrape, with global_end_of_trial_date parsed
+    valid_from, valid_to -- Completion dates outside this window are treated as missing (as date_fix)
+    completed_before -- Trials must have completed before this date to be included
+    """
+    #Trials in order of first appearance, as trial.unique()
+    codes, ids = protocols.eudract_number.factorize()
+    n = len(ids)
+
+    #Trials "Not Authorised" or "Prohibited by CA" in every country never started (as status_exclude)
+    _, first = np.unique(protocols.eudract_number_with_country.to_numpy(), return_index=True)
+    countries = np.bincount(codes[first], minlength=n)
+    not_started = np.bincount(codes, weights=protocols.end_of_trial_status.isin(NOT_STARTED).to_numpy(), minlength=n)
+    never_start = not_started == countries
+    started = ~never_start[codes]
+
+    #Latest protocol and results completion date per started trial, outliers removed (as group_dates/date_fix)
+    lo, hi = pd.Timestamp(valid_from).value, pd.Timestamp(valid_to).value
+    protocol_p = _group_max(codes, _dates(protocols.date_of_the_global_end_of_the_trial), n, started, _NAT)
+    found = pd.Index(results.trial_id).get_indexer(ids)
+    results_r = np.where((found >= 0) & ~never_start, _dates(results.global_end_of_trial_date)[found], _NAT)
+    protocol_p[(protocol_p < lo) | (protocol_p > hi)] = _NAT
+    results_r[(results_r < lo) | (results_r > hi)] = _NAT
+    available = np.where(results_r != _NAT, results_r, protocol_p)
+
+    #For started trials with no usable date, infer one from the latest approval plus the longest duration
+    no_completion = ~never_start & (available == _NAT)
+    rows = no_completion[codes]
+    approvals = np.maximum(_dates(protocols.date_of_competent_authority_decision)[rows],
+                           _dates(protocols.date_of_ethics_committee_opinion)[rows])
+    latest_approval = _group_max(codes[rows], approvals, n, slice(None), _NAT)
+    days = np.maximum(_duration_days(protocols, 'the_member_state_concerned', rows),
+                      _duration_days(protocols, 'all_countries_concerned_by_the_trial', rows))
+    max_days = _group_max(codes[rows], days, n, slice(None), -np.inf)
+    can_infer = no_completion & (max_days != 0) & (latest_approval != _NAT)
+    approval = pd.to_datetime(latest_approval[can_infer])
+    inferred_adj = np.full(n, _NAT)
+    inferred_adj[can_infer] = _dates(pd.Series(approval + pd.to_timedelta(max_days[can_infer], unit='D') +
+                                               pd.DateOffset(months=12)))
+
+    out = pd.DataFrame({'eudract_number': np.asarray(ids),
+                        'available_completion': available.view('datetime64[ns]'),
+                        'inferred_completion_adj': inferred_adj.view('datetime64[ns]')})
+    conds = [never_start,
+             no_completion & ~can_infer,
+             out.available_completion.notnull(),
+             out.inferred_completion_adj.notnull()]
+    labels = ['No EU Start', 'Cannot Infer', 'Extracted', 'Inferred']
+    out['exclusion_status'] = np.select(conds, labels, 'Unknown')
+    out['final_date'] = out.available_completion.where(out.available_completion.notnull(),
+                                                       out.inferred_completion_adj)
+    out['date_inclusion'] = np.where(out.final_date < pd.to_datetime(completed_before), 1, 0)
+    out['inferred'] = np.where(out.exclusion_status == 'Inferred', 1, 0)
+    return out
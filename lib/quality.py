@@ -0,0 +1,113 @@
+from collections import namedtuple
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+from lib.datasets import DATASETS, ROOT, _matches
+
+#Pairs of date columns where the first should not be after the second, and what it means if it is
+ORDERINGS = {
+    ('date_of_competent_authority_decision', 'date_of_the_global_end_of_the_trial'): 'approval after completion',
+    ('date_of_ethics_committee_opinion', 'date_of_the_global_end_of_the_trial'): 'approval after completion',
+    ('global_end_of_trial_date', 'first_version_date'): 'results before completion',
+    ('trial_start_date', 'global_end_of_trial_date'): 'start after completion',
+}
+
+#Columns tried, in order, for the trial ID to report
+ID_COLUMNS = ['eudract_number', 'trial_id', 'euctr_id', 'Trial ID']
+
+DateScan = namedtuple('DateScan', ['counts', 'issues'])
+DateScan.__doc__ = """
+The result of scan_dates.
+counts -- Number of values and of distinct trials failing each check, by check and column
+issues -- One row per failing value: row, trial_id, check, column (for orderings 'earlier > later') and value
+"""
+
+def _block(raw, formats):
+    #Every date column parsed into one int64 block of nanoseconds, each distinct string parsed once
+    block = np.empty((len(raw), len(formats)), dtype=np.int64)
+    unparseable = np.zeros(block.shape, dtype=bool)
+    unrepresentable = np.zeros(block.shape, dtype=bool)
+    for j, (col, fmt) in enumerate(formats.items()):
+        codes, uniques = pd.factorize(raw[col])
+        parsed = pd.to_datetime(uniques, format=fmt, errors='coerce')
+        inside = (parsed >= pd.Timestamp.min) & (parsed <= pd.Timestamp.max)
+        parsed = parsed.where(inside)
+        values = np.append(parsed.to_numpy(dtype='datetime64[ns]').view(np.int64), np.iinfo(np.int64).min)
+        failed = np.append(np.asarray(parsed.isna()), False)
+        #Only the few strings that failed are checked one by one, for real dates pandas can't hold
+        real = np.zeros(len(failed), dtype=bool)
+        real[np.flatnonzero(failed)] = [_matches(u, fmt) for u in np.asarray(uniques)[failed[:-1]]]
+        block[:, j] = values[codes]
+        unparseable[:, j] = (failed & ~real)[codes]
+        unrepresentable[:, j] = (failed & real)[codes]
+    return block, unparseable, unrepresentable
+
+def scan_dates(raw, formats, key=None, valid_from='2004-01-01', as_of=None, orderings=ORDERINGS):
+    """
+    Check every date column of a dataset in one pass over a block of all of them.
+    Checks, per value: 'unparseable' (doesn't match the format), 'out of range' (before valid_from,
+    or a real date pandas can't hold, e.g. year 0210) and 'future' (after as_of); and per row, each
+    ordering in orderings whose columns are both present.
+    Keyword arguments:
+    raw -- DataFrame with the date columns as the strings in the file (read with dtype=str)
+    formats -- Dict of date column to its strftime format, e.g. DATASETS['protocols'].dates
+    key -- Column with the trial ID. Default is the first of ID_COLUMNS present
+    valid_from -- Earliest plausible date. Default is the 2004 start of the EUCTR, as date_fix
+    as_of -- Dates after this are in the future. Default is today; use the scrape date for old scrapes
+    orderings -- Dict of (earlier column, later column) to a label. Default is ORDERINGS
+    """
+    key = key or next(c for c in ID_COLUMNS if c in raw.columns)
+    columns = list(formats)
+    block, unparseable, unrepresentable = _block(raw, formats)
+    nat = np.iinfo(np.int64).min
+    present = block != nat
+    lo = pd.Timestamp(valid_from).value
+    hi = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.today().normalize()).value
+
+    checks = {
+        'unparseable': unparseable,
+        'out of range': unrepresentable | (present & (block < lo)),
+        'future': present & (block > hi),
+    }
+    pairs = [(a, b, label) for (a, b), label in orderings.items() if a in formats and b in formats]
+    if pairs:
+        first = [columns.index(a) for a, _, _ in pairs]
+        second = [columns.index(b) for _, b, _ in pairs]
+        ordered = present[:, first] & present[:, second] & (block[:, first] > block[:, second])
+
+    ids = raw[key].to_numpy()
+    text = raw[columns].to_numpy()
+    parts = []
+    for check, mask in checks.items():
+        rows, cols = np.nonzero(mask)
+        parts.append(pd.DataFrame({'row': rows, 'trial_id': ids[rows], 'check': check,
+                                   'column': np.array(columns, dtype=object)[cols],
+                                   'value': text[rows, cols]}))
+    if pairs:
+        rows, k = np.nonzero(ordered)
+        labels = np.array([label for _, _, label in pairs], dtype=object)
+        names = np.array([f'{a} > {b}' for a, b, _ in pairs], dtype=object)
+        values = (pd.Series(text[rows, np.array(first)[k]], dtype=object) + ' > ' +
+                  pd.Series(text[rows, np.array(second)[k]], dtype=object)).to_numpy()
+        parts.append(pd.DataFrame({'row': rows, 'trial_id': ids[rows], 'check': labels[k],
+                                   'column': names[k], 'value': values}))
+    issues = pd.concat(parts, ignore_index=True)
+    counts = issues.groupby(['check', 'column']).agg(values=('row', 'size'), trials=('trial_id', 'nunique'))
+    return DateScan(counts, issues)
+
+def scan_dataset(name, path=None, root=ROOT, **kwargs):
+    """
+    scan_dates on a registered dataset, read as text so nothing is lost to parsing first.
+    Keyword arguments:
+    name -- A key of lib.datasets.DATASETS with date columns, e.g. 'protocols' or 'results_scrape'
+    path -- Optional file to scan instead of the dataset's own, e.g. a new scrape with the same columns
+    root -- The repo root
+    Any other keyword arguments go to scan_dates.
+    """
+    spec = DATASETS[name]
+    formats = spec.dates
+    key = kwargs.pop('key', None) or next(c for c in ID_COLUMNS if c in spec.columns)
+    raw = pd.read_csv(Path(root) / (path or spec.path), dtype=str, usecols=[key, *formats])
+    return scan_dates(raw, formats, key=key, **kwargs)
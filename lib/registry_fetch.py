@@ -0,0 +1,439 @@
+"""Fetch the registry records of cross-registered trials and read when each posted results,
+replacing the lookups the searchers made by hand for ctgov_results_date and isrctn_results_date.
+Requests run concurrently with a pool of keep-alive connections and a rate limit per host, are
+retried with backoff, and are cached on disk, so a re-run only goes to the network for new records.
+
+    python -m lib.registry_fetch [--rate 2] [--output dates.csv]
+
+For testing, serve recorded fixtures (see record_fixtures) and fetch from them instead:
+
+    python -m lib.registry_fetch --serve <fixture dir> --port 8052
+    python -m lib.registry_fetch --base http://127.0.0.1:8052 --cache <scratch dir>
+
+tests/fixtures/registries holds a small fixture set, used by tests/test_registry_fetch.py.
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import random
+import ssl
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+from lib.datasets import ROOT, load_dataset
+
+DEFAULT_CACHE = ROOT / 'data' / 'source_data' / 'registry_cache'
+
+USER_AGENT = 'euctr-results-fetcher/1.0'
+
+def parse_ctgov(body):
+    """A ClinicalTrials.gov API v2 study record: results posted, and the date results were first posted"""
+    doc = json.loads(body)
+    status = doc.get('protocolSection', {}).get('statusModule', {})
+    date = (status.get('resultsFirstPostDateStruct') or {}).get('date')
+    return {'results': bool(doc.get('hasResults')) or date is not None, 'results_date': date, 'detail': None}
+
+#ISRCTN output types that report results. Others, e.g. protocolfile, participantinfosheet,
+#protocolarticle or statisticalanalysisplan, are listed before a trial has any
+ISRCTN_RESULTS_OUTPUTS = frozenset({'basicresults', 'resultsarticle', 'interimresults', 'otherunpublishedresults',
+                                    'plainenglishresults', 'abstract', 'preprint', 'poster', 'funderreport',
+                                    'thesis'})
+
+def parse_isrctn(body):
+    """
+    An ISRCTN API trial record: whether it lists any results outputs (ISRCTN_RESULTS_OUTPUTS), the
+    date the first of those was added, and the types of all its outputs.
+    """
+    root = ET.fromstring(body)
+    outputs = [el for el in root.iter() if el.tag.rsplit('}', 1)[-1] == 'output']
+    results = [el for el in outputs if (el.get('outputType') or '').lower() in ISRCTN_RESULTS_OUTPUTS]
+    dates = pd.to_datetime([el.get('dateCreated') or el.get('dateUploaded') for el in results],
+                           errors='coerce', utc=True)
+    types = sorted({el.get('outputType') for el in outputs if el.get('outputType')})
+    date = dates.min() if len(dates) else pd.NaT
+    return {'results': bool(results), 'results_date': None if pd.isna(date) else date.strftime('%Y-%m-%d'),
+            'detail': ', '.join(types) or None}
+
+Registry = namedtuple('Registry', ['column', 'url', 'parse', 'date_column'])
+Registry.__doc__ = """
+A registry records are fetched from.
+column -- Column of the final dataset with the registry's IDs
+url -- Record URL, with {id} for the ID
+parse -- Called with a response body; returns a dict of results, results_date and detail
+date_column -- Column of the final dataset with the date the searchers recorded
+"""
+
+REGISTRIES = {
+    'ctgov': Registry('nct_id', 'https://clinicaltrials.gov/api/v2/studies/{id}', parse_ctgov, 'ctgov_results_date'),
+    'isrctn': Registry('isrctn_id', 'https://www.isrctn.com/api/trial/{id}/format/default', parse_isrctn,
+                       'isrctn_results_date'),
+}
+
+#Statuses worth trying again, after backing off
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+Response = namedtuple('Response', ['url', 'status', 'body', 'cached'])
+
+class ResponseCache:
+    """
+    Responses stored by the SHA-256 of their body, so identical records are stored once, with a
+    small reference file per URL pointing at the body. Only final answers (200 and 404) are kept.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE):
+        self.path = Path(path)
+
+    def _ref(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.path / 'refs' / key[:2] / f'{key}.json'
+
+    def _object(self, digest):
+        return self.path / 'objects' / digest[:2] / digest
+
+    @staticmethod
+    def _write(path, data):
+        #Written aside and renamed into place, so a crash never leaves a partial entry
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def get(self, url):
+        """The cached Response for a URL, or None"""
+        ref = self._ref(url)
+        if not ref.exists():
+            return None
+        meta = json.loads(ref.read_text())
+        obj = self._object(meta['content'])
+        if not obj.exists():
+            return None
+        return Response(url, meta['status'], obj.read_bytes(), True)
+
+    def put(self, url, status, body, **meta):
+        """Store a response. Extra keyword arguments are kept in the reference, e.g. registry and id"""
+        digest = hashlib.sha256(body).hexdigest()
+        obj = self._object(digest)
+        if not obj.exists():
+            self._write(obj, body)
+        ref = dict(meta, url=url, status=status, content=digest, fetched=pd.Timestamp.now(tz='UTC').isoformat())
+        self._write(self._ref(url), json.dumps(ref).encode())
+
+    def refs(self):
+        """Every cached reference, as dicts"""
+        return [json.loads(p.read_text()) for p in sorted((self.path / 'refs').glob('*/*.json'))]
+
+class _RateLimit:
+    #Spaces requests to one host at least 1 / rate seconds apart
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class _Host:
+    #Idle keep-alive connections to one host, at most max_connections open at once
+    def __init__(self, scheme, host, port, max_connections, rate):
+        self.scheme, self.host, self.port = scheme, host, port
+        self.slots = asyncio.Semaphore(max_connections)
+        self.idle = []
+        self.rate = _RateLimit(rate)
+
+    async def connect(self):
+        if self.idle:
+            return self.idle.pop()
+        context = ssl.create_default_context() if self.scheme == 'https' else None
+        return await asyncio.open_connection(self.host, self.port, ssl=context)
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+async def _read_response(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError('Connection closed before a response')
+    status = int(line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip(), 16)
+            if not size:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        body = bytes(body)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        headers['connection'] = 'close'
+    if headers.get('content-encoding', '').lower() == 'gzip':
+        body = gzip.decompress(body)
+    return status, headers, body
+
+class RegistryFetcher:
+    """
+    Concurrent, cached, rate limited fetching of registry records.
+
+    Example:
+    fetcher = RegistryFetcher()
+    dates = fetcher.results_dates(load_dataset('final_dataset'))
+    """
+
+    def __init__(self, cache=DEFAULT_CACHE, urls=None, rate=2.0, max_connections=4, retries=4, backoff=1.0,
+                 timeout=30.0):
+        """
+        Keyword arguments:
+        cache -- Directory for the response cache, or None to cache nothing
+        urls -- Optional dict of registry name to URL template, overriding REGISTRIES, e.g. fixture_urls(...)
+        rate -- Requests per second to each host
+        max_connections -- Connections kept open to each host
+        retries -- Further attempts after a connection error, timeout or RETRY_STATUSES response
+        backoff -- Seconds before the first retry, doubling each time, with jitter. A Retry-After header wins
+        timeout -- Seconds allowed for each attempt
+        """
+        self.cache = ResponseCache(cache) if cache is not None else None
+        self.urls = {name: r.url for name, r in REGISTRIES.items()}
+        self.urls.update(urls or {})
+        self.rate = rate
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._hosts = {}
+
+    def _host(self, url):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        if key not in self._hosts:
+            self._hosts[key] = _Host(parts.scheme, parts.hostname, port, self.max_connections, self.rate)
+        return self._hosts[key]
+
+    async def _attempt(self, host, url):
+        parts = urlsplit(url)
+        target = parts.path + (f'?{parts.query}' if parts.query else '')
+        request = (f'GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\nUser-Agent: {USER_AGENT}\r\n'
+                   f'Accept-Encoding: gzip\r\nConnection: keep-alive\r\n\r\n').encode()
+        reader, writer = await host.connect()
+        try:
+            writer.write(request)
+            await writer.drain()
+            status, headers, body = await _read_response(reader)
+        except BaseException:
+            writer.close()
+            raise
+        if headers.get('connection', '').lower() == 'close':
+            writer.close()
+        else:
+            host.idle.append((reader, writer))
+        return status, headers, body
+
+    async def get(self, url, **meta):
+        """
+        One URL, from the cache if it's there. Returns a Response; gives up with the last
+        response, or raises the last error, once retries are used up.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(url)
+            if cached is not None:
+                return cached
+        host = self._host(url)
+        for attempt in range(self.retries + 1):
+            wait = self.backoff * 2 ** attempt * (0.5 + random.random())
+            try:
+                async with host.slots:
+                    await host.rate.wait()
+                    status, headers, body = await asyncio.wait_for(self._attempt(host, url), self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                if attempt == self.retries:
+                    raise
+            else:
+                if status not in RETRY_STATUSES or attempt == self.retries:
+                    if self.cache is not None and status in (200, 404):
+                        self.cache.put(url, status, body, **meta)
+                    return Response(url, status, body, False)
+                retry_after = headers.get('retry-after', '')
+                wait = float(retry_after) if retry_after.isdigit() else wait
+            await asyncio.sleep(wait)
+
+    async def _record(self, registry, trial_id):
+        url = self.urls[registry].format(id=trial_id)
+        row = {'registry': registry, 'id': trial_id, 'status': None, 'results': None, 'results_date': None,
+               'detail': None, 'cached': False, 'error': None}
+        try:
+            response = await self.get(url, registry=registry, id=trial_id)
+        except Exception as e:
+            row['error'] = f'{type(e).__name__}: {e}'
+            return row
+        row.update(status=response.status, cached=response.cached)
+        if response.status == 200:
+            try:
+                row.update(REGISTRIES[registry].parse(response.body))
+            except (ValueError, ET.ParseError) as e:
+                row['error'] = f'Unparseable record: {e}'
+        elif response.status != 404:
+            row['error'] = f'HTTP {response.status}'
+        return row
+
+    async def fetch(self, pairs):
+        """Records for a list of (registry, id) pairs, concurrently; a list of dicts in the same order"""
+        try:
+            return await asyncio.gather(*(self._record(registry, i) for registry, i in pairs))
+        finally:
+            for host in self._hosts.values():
+                host.close()
+            self._hosts = {}
+
+    async def aresults_dates(self, df=None, key='euctr_id', registries=None):
+        """results_dates, to await in a running event loop, e.g. in a notebook: await fetcher.aresults_dates()"""
+        df = load_dataset('final_dataset') if df is None else df
+        wanted = []
+        for name in registries or REGISTRIES:
+            column = REGISTRIES[name].column
+            if column in df.columns:
+                linked = df[df[column].notna()]
+                recorded = linked[REGISTRIES[name].date_column] if REGISTRIES[name].date_column in df.columns else None
+                for i, (trial, rid) in enumerate(zip(linked[key], linked[column].str.strip())):
+                    wanted.append((trial, name, rid, None if recorded is None else recorded.iloc[i]))
+        unique = list(dict.fromkeys((name, rid) for _, name, rid, _ in wanted))
+        fetched = dict(zip(unique, await self.fetch(unique)))
+        out = pd.DataFrame([dict(fetched[(name, rid)], **{key: trial, 'recorded_date': recorded})
+                            for trial, name, rid, recorded in wanted],
+                           columns=[key, 'registry', 'id', 'status', 'results', 'results_date', 'detail', 'cached',
+                                    'error', 'recorded_date'])
+        out['results_date'] = pd.to_datetime(out.results_date, errors='coerce')
+        out['recorded_date'] = pd.to_datetime(out.recorded_date, errors='coerce')
+        return out
+
+    def results_dates(self, df=None, key='euctr_id', registries=None):
+        """
+        Fetch the record of every linked ID and read its results posting date.
+        Returns one row per trial and registry ID: key, registry, id, status (HTTP, 404 for an
+        unknown ID), results, results_date, detail, cached, error, and recorded_date, the date the
+        searchers entered, where the data has it.
+        Safe to call where an event loop is already running, e.g. Jupyter, which asyncio.run is not:
+        the fetch then runs on a worker thread with its own loop. Use aresults_dates to await it instead.
+        Keyword arguments:
+        df -- Data with the key and registry ID columns. Default is the final dataset
+        key -- The trial ID column
+        registries -- Names in REGISTRIES to fetch from. Default is all
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aresults_dates(df, key, registries))
+        with ThreadPoolExecutor(1) as pool:
+            return pool.submit(asyncio.run, self.aresults_dates(df, key, registries)).result()
+
+def fixture_urls(base):
+    """URL templates for every registry served by serve_fixtures at base, e.g. 'http://127.0.0.1:8052'"""
+    return {name: f'{base.rstrip("/")}/{name}/{{id}}' for name in REGISTRIES}
+
+def record_fixtures(directory, cache=DEFAULT_CACHE):
+    """
+    Copy cached responses into a fixture directory for serve_fixtures, as <registry>/<id> files.
+    Returns the number written.
+    """
+    cache = ResponseCache(cache)
+    written = 0
+    for ref in cache.refs():
+        if ref.get('registry') and ref.get('id') and ref['status'] == 200:
+            path = Path(directory) / ref['registry'] / ref['id']
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(cache.get(ref['url']).body)
+            written += 1
+    return written
+
+async def serve_fixtures(directory, host='127.0.0.1', port=8052, flaky=0):
+    """
+    A stand-in registry server answering GET /<registry>/<id> from <directory>/<registry>/<id>,
+    404 for anything missing, over keep-alive HTTP/1.1.
+    Keyword arguments:
+    directory -- Fixture directory, e.g. as written by record_fixtures
+    host -- Interface to listen on
+    port -- Port to listen on
+    flaky -- Answer each path with 503 this many times before serving it, to exercise retries
+    """
+    directory = Path(directory)
+    failures = {}
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                path = line.split()[1].decode().lstrip('/')
+                fixture = directory / path
+                if failures.get(path, 0) < flaky:
+                    failures[path] = failures.get(path, 0) + 1
+                    status, body = '503 Service Unavailable', b''
+                elif '..' not in path and fixture.is_file():
+                    status, body = '200 OK', fixture.read_bytes()
+                else:
+                    status, body = '404 Not Found', b''
+                writer.write(f'HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\n\r\n'.encode() + body)
+                await writer.drain()
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f'Serving fixtures from {directory} on http://{host}:{port}')
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch registry records and their results posting dates')
+    parser.add_argument('--cache', default=DEFAULT_CACHE)
+    parser.add_argument('--rate', type=float, default=2.0, help='Requests per second per host')
+    parser.add_argument('--base', help='Fetch from a fixture server at this URL instead of the registries')
+    parser.add_argument('--output', help='CSV to write the dates to')
+    parser.add_argument('--serve', metavar='DIR', help='Serve the fixtures in DIR instead of fetching')
+    parser.add_argument('--port', type=int, default=8052)
+    args = parser.parse_args()
+    if args.serve:
+        asyncio.run(serve_fixtures(args.serve, port=args.port))
+        return
+    fetcher = RegistryFetcher(args.cache, urls=fixture_urls(args.base) if args.base else None, rate=args.rate)
+    start = time.perf_counter()
+    dates = fetcher.results_dates()
+    print(dates.groupby('registry').agg(ids=('id', 'nunique'), results=('results', 'sum'),
+                                        cached=('cached', 'sum'), errors=('error', 'count')).to_string())
+    print(f'{time.perf_counter() - start:.2f}s')
+    if args.output:
+        dates.to_csv(args.output, index=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import re
+
+import pandas as pd
+import numpy as np
+
+from lib.eudract import is_eudract
+
+#Text and link fields in the searchers' data that can hold registry IDs
+ID_FIELDS = ['journal_reg_numbers', 'euctr_results_link', 'ctgov_results_link', 'isrctn_results_link',
+             'isrctn_additional_links', 'nct_id', 'isrctn_id']
+
+#One pattern with a named group per registry, so every field is searched once. IDs are allowed
+#the spacing and dash variants they turn up with in free text; normalize_ids tidies them
+ID_PATTERN = re.compile(r'(?P<nct>\bNCT\s?\d{8}(?!\d))'
+                        r'|(?P<isrctn>\bISRCTN\s?\d{8}(?!\d))'
+                        r'|(?P<eudract>(?<!\d)(?:19|20)\d{2}[\s\-\u2010-\u2013]\d{6}[\s\-\u2010-\u2013]\d{2}(?!\d))',
+                        re.IGNORECASE)
+REGISTRIES = list(ID_PATTERN.groupindex)
+
+#Canonical forms, as normalize_ids gives them
+CANONICAL = {'nct': r'NCT\d{8}', 'isrctn': r'ISRCTN\d{8}', 'eudract': r'\d{4}-\d{6}-\d{2}'}
+
+#The EudraCT database opened in 2004; the earliest numbers are from then
+EUDRACT_FIRST_YEAR = 2004
+
+def normalize_ids(registry, ids):
+    """
+    Put matched IDs into their registry's canonical form: NCT01234567, ISRCTN12345678 or 2004-000091-14.
+    Keyword arguments:
+    registry -- 'nct', 'isrctn' or 'eudract'
+    ids -- A series of matched strings
+    """
+    digits = ids.str.replace(r'\D', '', regex=True)
+    if registry == 'eudract':
+        return digits.str[:4] + '-' + digits.str[4:10] + '-' + digits.str[10:]
+    return registry.upper() + digits
+
+def valid_ids(registry, ids):
+    """
+    Whether normalized IDs are well formed. EudraCT numbers must also have a year from 2004 to
+    this year. None of the three registries publishes a check-digit scheme, so format is all that is checked.
+    Keyword arguments:
+    registry -- 'nct', 'isrctn' or 'eudract'
+    ids -- A series of normalized IDs
+    """
+    if registry == 'eudract':
+        year = pd.to_numeric(ids.str[:4], errors='coerce')
+        return pd.Series(is_eudract(ids), index=ids.index) & year.between(EUDRACT_FIRST_YEAR, pd.Timestamp.today().year)
+    return ids.str.fullmatch(rf'{registry.upper()}\d{{8}}').fillna(False).astype(bool)
+
+def registry_of(ids, other='other'):
+    """
+    The registry each ID is from, by its canonical form, or other for anything else, e.g. a sponsor's protocol number.
+    Keyword arguments:
+    ids -- A series of IDs
+    other -- Label for IDs of no known registry
+    """
+    ids = pd.Series(ids, dtype=object).astype(str)
+    conditions = [ids.str.fullmatch(p).to_numpy(dtype=bool) for p in CANONICAL.values()]
+    return np.select(conditions, list(CANONICAL), default=other).astype(object)
+
+def extract_ids(df, columns=None, key=None):
+    """
+    Every registry ID in the given text columns, as a long table with one row per distinct ID per
+    field per record: the record's index (and key, if given), field, registry, id (normalized),
+    match (as found) and valid.
+    Keyword arguments:
+    df -- DataFrame with the text columns
+    columns -- Columns to search. Default is those of ID_FIELDS present
+    key -- Optional column to carry through, e.g. 'euctr_id'
+    """
+    columns = [c for c in ID_FIELDS if c in df.columns] if columns is None else list(columns)
+    #All fields searched as one series, skipping empty ones and any without a digit
+    text = df[columns].stack()
+    text = text[text.astype(str).str.contains(r'\d', regex=True)].astype(str)
+    found = text.str.extractall(ID_PATTERN)
+    out = []
+    for registry in REGISTRIES:
+        matched = found[registry].dropna()
+        ids = normalize_ids(registry, matched)
+        rows = matched.index.droplevel('match')
+        out.append(pd.DataFrame({'record': rows.get_level_values(0), 'field': rows.get_level_values(1),
+                                 'registry': registry, 'id': ids.to_numpy(), 'match': matched.to_numpy(),
+                                 'valid': valid_ids(registry, ids).to_numpy()}))
+    ids = pd.concat(out, ignore_index=True).drop_duplicates(['record', 'field', 'id'])
+    if key is not None:
+        ids.insert(1, key, df[key].reindex(ids.record).to_numpy())
+    return ids.sort_values(['record', 'field', 'registry'], kind='stable').reset_index(drop=True)
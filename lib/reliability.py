@@ -0,0 +1,125 @@
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+
+Reliability = namedtuple('Reliability', ['summary', 'disagreements', 'by_coder'])
+
+def _label_pairs(pairs):
+    if isinstance(pairs, dict):
+        return list(pairs.keys()), list(pairs.values())
+    pairs = list(pairs)
+    return [first for first, _ in pairs], pairs
+
+def _stack_codes(df, pairs):
+    first = df[[a for a, _ in pairs]]
+    second = df[[b for _, b in pairs]]
+    if first.isna().any().any() or second.isna().any().any():
+        raise ValueError('Coding columns contain missing values; drop those rows first')
+    a = first.to_numpy(dtype=np.int64)
+    b = second.to_numpy(dtype=np.int64)
+    #Re-code every value into 0..n_cats-1 so counts can be taken with a single bincount
+    cats, codes = np.unique(np.concatenate([a, b]), return_inverse=True)
+    codes = codes.reshape(2 * len(a), -1)
+    return codes[:len(a)], codes[len(a):], len(cats)
+
+def _one_hot(codes, n_cats):
+    n, k = codes.shape
+    out = np.zeros((n, k * n_cats), dtype=np.int64)
+    out[np.arange(n)[:, None], np.arange(k) * n_cats + codes] = 1
+    return out
+
+def _kappa(n_agree, counts_a, counts_b, n):
+    """
+    Cohen's kappa from agreement counts and per-category marginals.
+    Works on any leading dimensions: n_agree and n are (..., k), the counts are (..., k, n_cats).
+    """
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_o = n_agree / n
+        p_e = (counts_a * counts_b).sum(axis=-1) / n ** 2
+        return (p_o - p_e) / (1 - p_e)
+
+def inter_rater_reliability(df, pairs, coder=None, n_boot=1000, ci=.95, random_state=None):
+    """
+    Percent agreement and Cohen's kappa for several dual-coded fields at once.
+    Keyword arguments:
+    df -- The dataframe holding one row per dual-coded trial
+    pairs -- A list of (first coder column, second coder column) tuples, or a dict of {label: (first, second)}
+    coder -- Optional column naming who did the second coding (e.g. 'second_coder') for a per-coder breakdown
+    n_boot -- Number of bootstrap resamples for the CIs. 0 skips them
+    ci -- Width of the bootstrap CIs. Default is .95
+    random_state -- Seed for the bootstrap
+
+    Returns a Reliability namedtuple of:
+    summary -- DataFrame indexed by field with n, agreement, kappa and their CIs
+    disagreements -- Dict of field to the df index labels where the coders disagreed
+    by_coder -- DataFrame indexed by (coder, field) with n, agreement and kappa, or None
+    """
+    labels, pairs = _label_pairs(pairs)
+    a, b, n_cats = _stack_codes(df, pairs)
+    n, k = a.shape
+    agree = a == b
+    onehot_a = _one_hot(a, n_cats)
+    onehot_b = _one_hot(b, n_cats)
+
+    n_agree = agree.sum(axis=0)
+    counts_a = onehot_a.sum(axis=0).reshape(k, n_cats)
+    counts_b = onehot_b.sum(axis=0).reshape(k, n_cats)
+
+    summary = pd.DataFrame({'n': n,
+                            'agreement': n_agree / n,
+                            'kappa': _kappa(n_agree, counts_a, counts_b, n)}, index=pd.Index(labels, name='field'))
+
+    if n_boot:
+        rng = np.random.default_rng(random_state)
+        #Each row of weights is how often each trial is drawn in that resample,
+        #so every replicate's counts fall out of one matrix product
+        weights = rng.multinomial(n, np.full(n, 1 / n), size=n_boot)
+        boot_agree = weights @ agree
+        boot_a = (weights @ onehot_a).reshape(n_boot, k, n_cats)
+        boot_b = (weights @ onehot_b).reshape(n_boot, k, n_cats)
+        boot_kappa = _kappa(boot_agree, boot_a, boot_b, n)
+        tails = [(1 - ci) / 2 * 100, (1 + ci) / 2 * 100]
+        agree_ci = np.percentile(boot_agree / n, tails, axis=0)
+        kappa_ci = np.nanpercentile(boot_kappa, tails, axis=0)
+        summary['agreement_lower'], summary['agreement_upper'] = agree_ci
+        summary['kappa_lower'], summary['kappa_upper'] = kappa_ci
+        summary = summary[['n', 'agreement', 'agreement_lower', 'agreement_upper',
+                           'kappa', 'kappa_lower', 'kappa_upper']]
+
+    rows, cols = np.nonzero(~agree)
+    disagreements = {label: df.index[rows[cols == j]] for j, label in enumerate(labels)}
+
+    by_coder = None
+    if coder is not None:
+        groups, group_ids = np.unique(df[coder].astype(str).to_numpy(), return_inverse=True)
+        g = len(groups)
+        group_n = np.bincount(group_ids, minlength=g)
+        group_agree = np.zeros((g, k), dtype=np.int64)
+        np.add.at(group_agree, group_ids, agree)
+        group_a = np.zeros((g, k * n_cats), dtype=np.int64)
+        np.add.at(group_a, group_ids, onehot_a)
+        group_b = np.zeros((g, k * n_cats), dtype=np.int64)
+        np.add.at(group_b, group_ids, onehot_b)
+        group_kappa = _kappa(group_agree, group_a.reshape(g, k, n_cats),
+                             group_b.reshape(g, k, n_cats), group_n[:, None])
+        by_coder = pd.DataFrame({'n': np.repeat(group_n, k),
+                                 'agreement': (group_agree / group_n[:, None]).ravel(),
+                                 'kappa': group_kappa.ravel()},
+                                index=pd.MultiIndex.from_product([groups, labels], names=[coder, 'field']))
+
+    return Reliability(summary, disagreements, by_coder)
+
+def match_rate(df, pair, match, matched=1):
+    """
+    Of the trials where both coders found something, how often did they find the same thing?
+    Keyword arguments:
+    df -- The dataframe holding one row per dual-coded trial
+    pair -- A (first coder column, second coder column) tuple, both coded 1 when something was found
+    match -- The column recording whether the two coders' findings matched
+    matched -- The value of `match` that means they did. Default is 1
+
+    Returns (number matched, number both found) ready for summarizer or ci_calc
+    """
+    both = (df[pair[0]] == 1) & (df[pair[1]] == 1)
+    return int((df.loc[both, match] == matched).sum()), int(both.sum())
@@ -0,0 +1,87 @@
+import pandas as pd
+import numpy as np
+
+#For each place results can be found: the column saying results were found, the value meaning yes,
+#and the column with the date they became available
+RESULTS_SOURCES = {
+    'euctr': ('euctr_results', 'Yes', 'euctr_results_date'),
+    'ctgov': ('ctgov_results', 'Yes', 'ctgov_results_date'),
+    'isrctn': ('isrctn_results', 'Yes', 'isrctn_results_date'),
+    'journal': ('journal_result', 'Yes', 'journal_pub_date'),
+}
+
+#Registry results rates are out of the trials cross-registered there, as in the Analysis notebook
+REGISTRY_IDS = {'ctgov': 'nct_id', 'isrctn': 'isrctn_id'}
+
+def results_dates(df, sources=RESULTS_SOURCES):
+    """
+    The date each trial's results became available in each source, NaT where there are none,
+    plus the earliest across all sources as 'any'.
+    Keyword arguments:
+    df -- The searchers' dataset (e.g. analysis_df) with dates already parsed
+    sources -- Dict of source name to (found column, found value, date column). Default is RESULTS_SOURCES
+    """
+    dates = pd.DataFrame(index=df.index)
+    for name, (found, yes, date) in sources.items():
+        dates[name] = df[date].where(df[found] == yes)
+    dates['any'] = dates.min(axis=1)
+    return dates
+
+def results_inc(df, cutoff, sources=RESULTS_SOURCES):
+    """
+    The notebook's *_results_inc flags for an arbitrary cutoff: 1 if results were available
+    in that source on or before the cutoff date, else 0.
+    Keyword arguments:
+    df -- The searchers' dataset with dates already parsed
+    cutoff -- The date results had to be available by
+    sources -- As for results_dates
+    """
+    dates = results_dates(df, sources)
+    flags = (dates <= pd.to_datetime(cutoff)).astype(int)
+    flags.columns = [f'{c}_results_inc' for c in flags.columns]
+    return flags
+
+def results_by_cutoff(df, cutoffs, sources=RESULTS_SOURCES, eligible=REGISTRY_IDS):
+    """
+    Number and share of trials with results available in each source, and in any source,
+    for every date in cutoffs. Each source's dates are sorted once and every cutoff is
+    answered with a binary search, so a daily curve costs about the same as a single cut.
+    Shares are out of all trials, except for sources in eligible, which are out of the trials
+    registered there, as in census_summary and OutcomeCube.
+    Keyword arguments:
+    df -- The searchers' dataset with dates already parsed
+    cutoffs -- A list-like of dates
+    sources -- As for results_dates
+    eligible -- Dict of source name to a column that must be non-null for a trial to count towards
+    it. Default is REGISTRY_IDS; pass {} for shares of all trials
+    """
+    cutoffs = pd.DatetimeIndex(pd.to_datetime(cutoffs), name='cutoff')
+    dates = results_dates(df, sources)
+    out = pd.DataFrame(index=cutoffs)
+    totals = {}
+    for name in dates.columns:
+        col = dates[name].to_numpy(dtype='datetime64[ns]')
+        counted = np.ones(len(col), dtype=bool)
+        if name in eligible and eligible[name] in df.columns:
+            counted = df[eligible[name]].notnull().to_numpy()
+        totals[name] = counted.sum()
+        col = col[counted]
+        ordered = np.sort(col[~np.isnat(col)])
+        #side='right' so a result dated on the cutoff itself counts, matching `<= search_start_date`
+        out[name] = np.searchsorted(ordered, cutoffs.to_numpy(dtype='datetime64[ns]'), side='right')
+    for name in dates.columns:
+        out[f'{name}_prct'] = out[name] / totals[name] if totals[name] else np.nan
+    return out
+
+def reporting_curve(df, start, end, freq='D', sources=RESULTS_SOURCES, eligible=REGISTRY_IDS):
+    """
+    Cumulative share of trials with results over calendar time, from start to end at the given frequency.
+    Keyword arguments:
+    df -- The searchers' dataset with dates already parsed
+    start -- First date on the curve
+    end -- Last date on the curve, e.g. search_start_date or last_search_any
+    freq -- Any pandas date frequency. Default is 'D' (daily)
+    sources -- As for results_dates
+    eligible -- As for results_by_cutoff
+    """
+    return results_by_cutoff(df, pd.date_range(start, end, freq=freq), sources, eligible)
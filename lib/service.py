@@ -0,0 +1,185 @@
+"""A small offline HTTP service answering questions about individual trials and slices of
+the sample from the derived datasets, without opening the notebooks.
+
+    python -m lib.service [--host 127.0.0.1] [--port 8051]
+
+GET /trials/<eudract_number>       one trial's record
+GET /slice?outcome=euctr&<dim>=..  counts, proportion and CI for one slice of the sample
+GET /table?outcome=euctr&by=<dim>  the same for every level of a dimension
+GET /population?by=<column>        counts of register trials by exclusion_status, inferred or date_inclusion
+"""
+import argparse
+import asyncio
+import json
+from functools import lru_cache
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import pandas as pd
+import numpy as np
+
+from lib.cube import ALL, OutcomeCube
+from lib.datasets import load_dataset
+from lib.eudract import MISSING, encode_eudract
+from lib.processing import trial_population
+from lib.trial_table import TrialTable
+
+#What a trial lookup returns, by column group
+RECORD_COLUMNS = {
+    'population': ['exclusion_status', 'available_completion', 'inferred_completion_adj', 'final_date',
+                   'date_inclusion', 'inferred'],
+    'search': ['euctr_results', 'euctr_results_date', 'euctr_results_link', 'nct_id', 'ctgov_results',
+               'ctgov_results_date', 'ctgov_results_link', 'isrctn_id', 'isrctn_results', 'isrctn_results_date',
+               'isrctn_results_link', 'journal_result', 'journal_pub_date', 'journal_link', 'euctr_results_inc',
+               'ctgov_results_inc', 'isrctn_results_inc', 'journal_results_inc', 'any_results_inc'],
+    'sponsor': ['sponsor_status', 'sponsor_country'],
+    'manual': ['Trial Start Year', 'Enrollment'],
+}
+
+#Dimensions slice and table queries can use
+CUBE_DIMS = ['sponsor_status', 'sponsor_country', 'inferred', 'Trial Start Year']
+
+POPULATION_COLUMNS = ['exclusion_status', 'inferred', 'date_inclusion']
+
+def _jsonable(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).date().isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+class TrialService:
+    """
+    The derived per-trial records and outcome cube, held in memory, with a cached JSON
+    response for each distinct request.
+    """
+
+    def __init__(self, records, cube, population_counts, cache_size=1024):
+        """
+        Use TrialService.load rather than calling this directly.
+        Keyword arguments:
+        records -- DataFrame of RECORD_COLUMNS indexed by trial_id, sorted
+        cube -- OutcomeCube over the searched sample
+        population_counts -- Dict of POPULATION_COLUMNS to their value counts over the register
+        cache_size -- Number of responses kept, least recently used dropped first
+        """
+        self.records = records
+        self.keys = encode_eudract(records.index.to_series(), errors='coerce').to_numpy()
+        self.cube = cube
+        self.population_counts = population_counts
+        self.respond = lru_cache(maxsize=cache_size)(self._respond)
+
+    @classmethod
+    def load(cls, cache_size=1024):
+        """Build the records from the data folder: the register population, the searchers' data and the sponsor data"""
+        population = trial_population(load_dataset('protocols'), load_dataset('results_scrape'))
+        sample = pd.concat([load_dataset('search_sample'), load_dataset('replacement_sample')])
+        trials = TrialTable(population.eudract_number)
+        trials.attach('population', population, 'eudract_number', RECORD_COLUMNS['population'])
+        trials.attach('search', load_dataset('analysis_df'), 'euctr_id', RECORD_COLUMNS['search'])
+        trials.attach('sponsor', load_dataset('spon_country_data'), 'trial_id', RECORD_COLUMNS['sponsor'])
+        trials.attach('manual', load_dataset('manual_reg_data'), 'Trial ID', RECORD_COLUMNS['manual'])
+        records = trials.frame([c for cols in RECORD_COLUMNS.values() for c in cols])
+
+        #The cube is over the searched trials only (not those replaced), with inferred as it was when sampled
+        searched = records[records.any_results_inc.notna()].copy()
+        searched['inferred'] = searched.index.map(sample.set_index('eudract_number').inferred)
+        cube = OutcomeCube.build(searched, CUBE_DIMS)
+        counts = {c: population[c].value_counts(dropna=False).sort_index() for c in POPULATION_COLUMNS}
+        return cls(records, cube, counts, cache_size)
+
+    def trial(self, trial_id):
+        key = encode_eudract([trial_id], errors='coerce')[0]
+        pos = np.searchsorted(self.keys, key)
+        if key == MISSING or pos == len(self.keys) or self.keys[pos] != key:
+            return HTTPStatus.NOT_FOUND, {'error': f'No trial {trial_id!r}'}
+        row = self.records.iloc[pos]
+        return HTTPStatus.OK, {'trial_id': self.records.index[pos],
+                               **{c: _jsonable(v) for c, v in row.items()}}
+
+    def _selection(self, params):
+        selection = {}
+        for dim, value in params.items():
+            if dim not in self.cube.dims:
+                raise KeyError(f'Unknown dimension {dim!r}; use one of {self.cube.dims}')
+            levels = self.cube.levels[self.cube.dims.index(dim)]
+            #Query strings are text, so numeric levels are converted back
+            selection[dim] = value if value == ALL or levels.dtype.kind in 'OUS' else levels.dtype.type(value)
+        return selection
+
+    def _respond(self, target):
+        #Cached as encoded bytes, so a repeated request costs a dict lookup
+        status, body = self._route(target)
+        return status, json.dumps(body).encode()
+
+    def _route(self, target):
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        path = unquote(url.path).rstrip('/')
+        try:
+            if path.startswith('/trials/'):
+                return self.trial(path[len('/trials/'):])
+            if path == '/slice':
+                outcome = params.pop('outcome', 'any')
+                cell = self.cube.query(outcome, **self._selection(params))
+                return HTTPStatus.OK, {'outcome': outcome, **params, **{k: _jsonable(v) for k, v in cell._asdict().items()}}
+            if path == '/table':
+                outcome, by = params.pop('outcome', 'any'), params.pop('by')
+                table = self.cube.table(outcome, by, **self._selection(params)).reset_index()
+                return HTTPStatus.OK, [{k: _jsonable(v) for k, v in row.items()} for row in table.to_dict('records')]
+            if path == '/population':
+                by = params.get('by', 'exclusion_status')
+                if by not in self.population_counts:
+                    raise KeyError(f'Unknown column {by!r}; use one of {POPULATION_COLUMNS}')
+                counts = self.population_counts[by]
+                return HTTPStatus.OK, {str(_jsonable(k)): int(v) for k, v in counts.items()}
+            if path == '':
+                return HTTPStatus.OK, {'trials': len(self.records), 'cube': repr(self.cube)}
+        except (KeyError, ValueError) as e:
+            return HTTPStatus.BAD_REQUEST, {'error': str(e).strip('"')}
+        return HTTPStatus.NOT_FOUND, {'error': f'No route for {url.path}'}
+
+    async def handle(self, reader, writer):
+        """Answer one connection: a single GET, then close"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if len(request_line) != 3:
+                status, payload = HTTPStatus.BAD_REQUEST, b'{"error": "Malformed request"}'
+            elif request_line[0] != 'GET':
+                status, payload = HTTPStatus.METHOD_NOT_ALLOWED, b'{"error": "Only GET is supported"}'
+            else:
+                status, payload = self.respond(request_line[1])
+            writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                         f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode() + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def serve(service, host='127.0.0.1', port=8051):
+    """Serve requests until cancelled. Connections are handled concurrently"""
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f'Serving {len(service.records)} trials on http://{host}:{port}/')
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve per-trial records and sample slices as JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8051)
+    parser.add_argument('--cache-size', type=int, default=1024, help='Number of responses to cache')
+    args = parser.parse_args()
+    service = TrialService.load(args.cache_size)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import sqlite3
+from collections import namedtuple
+from contextlib import closing
+from pathlib import Path
+
+import pandas as pd
+
+from lib.datasets import DATASETS, ROOT, parse_dates
+
+#Built on demand from the source data and not committed; see build_store
+DEFAULT_STORE = ROOT / 'data' / 'source_data' / 'euctr_store.sqlite'
+
+StoreTable = namedtuple('StoreTable', ['path', 'key', 'indexes', 'dataset'])
+StoreTable.__doc__ = """
+A table in the local store.
+path -- Source CSV relative to the repo root
+key -- The trial ID column, always indexed
+indexes -- Other columns to index
+dataset -- Name in lib.datasets.DATASETS to take dtypes and date formats from, or None
+"""
+
+STORE_TABLES = {
+    #Country protocols, with the country code off the end of eudract_number_with_country as protocol_country
+    'protocols': StoreTable(DATASETS['protocols'].path, 'eudract_number', ['protocol_country'], 'protocols'),
+    'results': StoreTable(DATASETS['results_scrape'].path, 'trial_id', [], 'results_scrape'),
+    #The Dec 2020 sponsor scrape is too big to commit; put a copy in data/source_data to include it
+    'sponsors': StoreTable('data/source_data/dec2020_spon_info.csv', 'trial_id', ['protocol_country'], None),
+}
+
+#How each table's protocol_country names sites outside the EU/EEA. The tables don't share a
+#vocabulary: protocols has the two letter code off eudract_number_with_country ('GB', 'DE', ...,
+#with lib.countries.THIRD_COUNTRY for the rest), the sponsor scrape has country names
+OUTSIDE_EU_EEA = {'protocols': '3rd', 'sponsors': 'Outside EU/EEA'}
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def build_store(path=DEFAULT_STORE, root=ROOT, tables=None, chunksize=50000):
+    """
+    Load the source data into an indexed SQLite file. Sources that aren't present are skipped.
+    Returns the names of the tables that were built.
+    Keyword arguments:
+    path -- Where to write the store. Any existing tables of the same name are replaced
+    root -- The repo root the source paths are relative to
+    tables -- Optional list of table names to (re)build. Default is all of STORE_TABLES
+    chunksize -- Rows read and inserted at a time
+    """
+    built = []
+    with closing(sqlite3.connect(path)) as con, con:
+        for name in tables or STORE_TABLES:
+            spec = STORE_TABLES[name]
+            source = Path(root) / spec.path
+            if not source.exists():
+                print(f'Skipping {name}: {spec.path} not found')
+                continue
+            dtype = DATASETS[spec.dataset].columns if spec.dataset else None
+            con.execute(f'DROP TABLE IF EXISTS {_quote(name)}')
+            for chunk in pd.read_csv(source, dtype=dtype, chunksize=chunksize, low_memory=False):
+                chunk = chunk.drop(columns=[c for c in chunk.columns if c.startswith('Unnamed: ')])
+                if name == 'protocols':
+                    chunk['protocol_country'] = chunk.eudract_number_with_country.str[15:]
+                chunk.to_sql(name, con, if_exists='append', index=False)
+            for col in [spec.key] + spec.indexes:
+                con.execute(f'CREATE INDEX {_quote(f"ix_{name}_{col}")} ON {_quote(name)} ({_quote(col)})')
+            built.append(name)
+        con.execute('ANALYZE')
+    return built
+
+def _connect(path):
+    if not Path(path).exists():
+        raise FileNotFoundError(f'No store at {path}; create it with lib.store.build_store()')
+    return closing(sqlite3.connect(path))
+
+def _typed(name, df):
+    spec = STORE_TABLES[name]
+    if spec.dataset:
+        for col, fmt in DATASETS[spec.dataset].dates.items():
+            if col in df.columns:
+                df[col] = parse_dates(df[col], fmt, f'{name}.{col}')
+    return df
+
+def load_filtered(table, trial_ids=None, countries=None, exclude_countries=None, columns=None, path=DEFAULT_STORE):
+    """
+    Load only the rows of a store table that are needed, using its indexes.
+    Keyword arguments:
+    table -- One of STORE_TABLES
+    trial_ids -- Optional list-like of trial IDs to keep
+    countries -- Optional list-like of protocol_country values to keep, in the table's own vocabulary:
+    codes such as 'GB' for protocols, names such as 'United Kingdom' for sponsors. results has no
+    protocol_country, so neither this nor exclude_countries applies to it
+    exclude_countries -- Optional list-like of protocol_country values to drop, e.g. [OUTSIDE_EU_EEA[table]]
+    columns -- Optional list of columns to return. Default is all of them
+    path -- The store file
+    """
+    spec = STORE_TABLES[table]
+    if (countries is not None or exclude_countries is not None) and 'protocol_country' not in spec.indexes:
+        raise ValueError(f'{table!r} has no protocol_country to filter countries on')
+    select = ', '.join(_quote(c) for c in columns) if columns else '*'
+    where, params = [], []
+    with _connect(path) as con:
+        if trial_ids is not None:
+            #Joining to a temporary table keeps the query on the index however many IDs there are
+            con.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (trial_id TEXT PRIMARY KEY)')
+            con.execute('DELETE FROM wanted')
+            con.executemany('INSERT OR IGNORE INTO wanted VALUES (?)', ((str(i),) for i in trial_ids))
+            where.append(f'{_quote(spec.key)} IN (SELECT trial_id FROM wanted)')
+        if countries is not None:
+            countries = list(countries)
+            where.append(f'protocol_country IN ({", ".join("?" * len(countries))})')
+            params += countries
+        if exclude_countries is not None:
+            exclude_countries = list(exclude_countries)
+            where.append(f'protocol_country NOT IN ({", ".join("?" * len(exclude_countries))})')
+            params += exclude_countries
+        query = f'SELECT {select} FROM {_quote(table)}'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        df = pd.read_sql_query(query, con, params=params)
+    return _typed(table, df)
+
+def lookup(table, trial_id, path=DEFAULT_STORE):
+    """
+    All rows of a store table for a single trial, for ad hoc checks.
+    Keyword arguments:
+    table -- One of STORE_TABLES
+    trial_id -- The EudraCT number, e.g. '2006-000666-37'
+    path -- The store file
+    """
+    return load_filtered(table, trial_ids=[trial_id], path=path)
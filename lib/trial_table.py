@@ -0,0 +1,146 @@
+import pandas as pd
+import numpy as np
+
+from lib.eudract import MISSING, decode_eudract, encode_eudract
+
+class TrialTable:
+    """
+    One row per trial, on a single sorted index of packed EudraCT numbers.
+    Datasets are attached by reference as named column groups, each with an array saying which of
+    its rows belongs to each trial, so nothing is copied when a dataset is joined. Columns are only
+    gathered into a new array when they are asked for.
+
+    Example, in place of the chain of merges that builds exploratory_final:
+    trials = TrialTable(analysis_df.euctr_id)
+    trials.attach('analysis', analysis_df, 'euctr_id')
+    trials.attach('sample', full_sample, 'eudract_number')
+    trials.attach('manual', regression, 'Trial ID')
+    trials.attach('sponsor', other_reg_data, 'trial_id')
+    trials.frame(['euctr_results_inc', 'inferred', 'Trial Start Year', 'sponsor_status'])
+    """
+
+    def __init__(self, trial_ids):
+        """
+        Keyword arguments:
+        trial_ids -- The trials in the table, as EudraCT number strings. Duplicates and missing values are dropped
+        """
+        packed = np.unique(encode_eudract(pd.Series(trial_ids)).to_numpy())
+        self.keys = packed[packed != MISSING]
+        self._groups = {}
+        self._ids = None
+
+    @classmethod
+    def _view(cls, keys, groups):
+        table = cls.__new__(cls)
+        table.keys = keys
+        table._groups = groups
+        table._ids = None
+        return table
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def index(self):
+        """The trial IDs as strings, decoded once and kept"""
+        if self._ids is None:
+            self._ids = pd.Index(decode_eudract(self.keys), name='trial_id')
+        return self._ids
+
+    def attach(self, name, df, key, columns=None):
+        """
+        Add a dataset with at most one row per trial as a column group. Rows for trials not in the
+        table are ignored; trials with no row get missing values.
+        Keyword arguments:
+        name -- What to call the column group
+        df -- The dataset. It is kept by reference, not copied
+        key -- The column of df holding the trial ID
+        columns -- Optional list of the columns to expose. Default is all but the key and any 'Unnamed: n' index columns
+        """
+        packed = encode_eudract(df[key], errors='coerce').to_numpy()
+        valid = packed != MISSING
+        if pd.Series(packed[valid]).duplicated().any():
+            raise ValueError(f'{name!r} has more than one row for some trials in {key!r}')
+        order = np.argsort(packed, kind='stable')
+        found = np.searchsorted(packed[order], self.keys)
+        hit = found < len(order)
+        hit[hit] = packed[order[found[hit]]] == self.keys[hit]
+        #Row of df for each trial, -1 where it has none
+        rows = np.full(len(self.keys), -1, dtype=np.int64)
+        rows[hit] = order[found[hit]]
+        if columns is None:
+            columns = [c for c in df.columns if c != key and not str(c).startswith('Unnamed: ')]
+        self._groups[name] = (df, rows, list(columns))
+        return self
+
+    def detach(self, name):
+        """Remove a column group"""
+        del self._groups[name]
+        return self
+
+    @property
+    def columns(self):
+        """Every column available, as (group, column) pairs"""
+        return [(name, c) for name, (_, _, cols) in self._groups.items() for c in cols]
+
+    def _locate(self, column):
+        if isinstance(column, tuple):
+            return column
+        if '.' in column and column.split('.', 1)[0] in self._groups:
+            return tuple(column.split('.', 1))
+        owners = [name for name, (_, _, cols) in self._groups.items() if column in cols]
+        if not owners:
+            raise KeyError(column)
+        if len(owners) > 1:
+            raise KeyError(f'{column!r} is in more than one group ({owners}); ask for it as "group.{column}"')
+        return owners[0], column
+
+    def __getitem__(self, column):
+        """
+        Gather one column, aligned to the trial index. Columns in more than one group
+        are asked for as 'group.column' or (group, column).
+        """
+        if isinstance(column, list):
+            return self.frame(column)
+        name, col = self._locate(column)
+        df, rows, _ = self._groups[name]
+        values = df[col].array
+        missing = rows < 0
+        if isinstance(df[col].dtype, np.dtype) and df[col].dtype.kind in 'iub' and missing.any():
+            #Gathered into nullable types, so trials with no row don't turn integer and boolean
+            #columns into floats. Only the gathered values are converted
+            data = np.zeros(len(rows), dtype=df[col].dtype)
+            data[~missing] = values.to_numpy()[rows[~missing]]
+            nullable = pd.arrays.BooleanArray if df[col].dtype.kind == 'b' else pd.arrays.IntegerArray
+            return pd.Series(nullable(data, missing), index=self.index, name=col)
+        values = pd.api.extensions.take(values, rows, allow_fill=True)
+        return pd.Series(values, index=self.index, name=col)
+
+    def frame(self, columns=None):
+        """
+        Materialize the given columns (default all) as a DataFrame indexed by trial_id.
+        Keyword arguments:
+        columns -- List of column names, 'group.column' strings or (group, column) tuples
+        """
+        if columns is None:
+            columns = self.columns
+        data = {}
+        for column in columns:
+            series = self[column]
+            data[column if not isinstance(column, tuple) else '.'.join(column)] = series.array
+        return pd.DataFrame(data, index=self.index)
+
+    def where(self, mask):
+        """
+        A table of just the trials where mask is True. Datasets are shared, not copied;
+        only the per-group row arrays are subset.
+        Keyword arguments:
+        mask -- Boolean array or Series aligned with the table, e.g. trials['inferred'] == 1. Missing values count as False
+        """
+        mask = pd.array(mask, dtype='boolean').to_numpy(dtype=bool, na_value=False)
+        groups = {name: (df, rows[mask], cols) for name, (df, rows, cols) in self._groups.items()}
+        return TrialTable._view(self.keys[mask], groups)
+
+    def __repr__(self):
+        groups = ', '.join(f'{name} ({len(cols)} columns)' for name, (_, _, cols) in self._groups.items())
+        return f'<TrialTable: {len(self)} trials; {groups or "no column groups"}>'
@@ -34,6 +34,8 @@ sys.path.append(parent)
 #importing custom functions for analysis
 
 from lib.functions import status_exclude, group_dates, date_fix
+from lib.corrections import apply_corrections
+from lib.datasets import load_dataset
 
 flowchart_dict = {}
 # -
@@ -461,14 +463,12 @@ spon_status = spon_df_filt[['trial_id', 'sponsor_status']].groupby('trial_id').m
 print(spon_status.sponsor_status.value_counts())
 
 # + trusted=true
-#Fixing the manually checked data.
+#Fixing the manually checked data. The corrections, with the reasons above, are kept in
+#data/additional_data/manual_corrections.csv; any that no longer match the data are listed here
 
-spon_status.loc['2007-004805-80', 'sponsor_status'] = 'Commercial'
-spon_status.loc['2006-000666-37', 'sponsor_status'] = 'Commercial'
-spon_status.loc['2012-000347-28', 'sponsor_status'] = 'Commercial'
-spon_status.loc['2012-001956-20', 'sponsor_status'] = 'Commercial'
-spon_status.loc['2011-000291-34', 'sponsor_status'] = 'Unknown'
-spon_status.loc['2007-003461-41', 'sponsor_status'] = 'Non-Commercial'
+corrections = load_dataset('manual_corrections')
+spon_status, not_applied = apply_corrections(spon_status, corrections[corrections.field == 'sponsor_status'], key=None)
+not_applied
 
 # + trusted=true
 print(spon_status.sponsor_status.value_counts())
@@ -501,8 +501,9 @@ to_join = grouped[~grouped.trial_id.isin(multi_country)]
 final_df = reg_df.merge(to_join, on='trial_id', how='left').drop('level_1', axis=1)
 
 # + trusted=true
-#Correcting that data from earlier
-final_df.loc[final_df[final_df.trial_id == '2007-004805-80'].index[0], 'sponsor_country'] = 'United Kingdom'
+#Correcting that data from earlier, along with the manual changes to sponsor country listed below
+final_df, not_applied = apply_corrections(final_df, corrections[corrections.field == 'sponsor_country'])
+not_applied
 
 # + trusted=true
 final_df['sponsor_country'] = final_df['sponsor_country'].fillna('Multi-country')
@@ -519,8 +520,8 @@ final_df[final_df.sponsor_country == 'No Data Available']
 # 2013-001103-36: Sponsor is "Tayside Medical Sciences Centre on behalf of University of Dundee & NHS Tayside" which is a UK sponsor
 
 # + trusted=true
-final_df.loc[final_df[final_df.trial_id == '2010-020521-40'].index[0], 'sponsor_country'] = 'Italy'
-final_df.loc[final_df[final_df.trial_id == '2013-001103-36'].index[0], 'sponsor_country'] = 'United Kingdom'
+#Applied from the corrections table above
+final_df[final_df.trial_id.isin(['2010-020521-40', '2013-001103-36'])]
 
 # + trusted=true
 final_df.head()
@@ -2,12 +2,16 @@
 browser on the correct port, and handle shutdowns gracefully
 
 """
+import argparse
+import asyncio
+import hashlib
+import http.client
+import http.cookiejar
+import json
 import os
 import signal
 import subprocess
-import socket
 import sys
-import time
 import urllib.request
 import webbrowser
 
@@ -15,59 +19,251 @@ tag = "datalab-notebook"
 current_dir = os.getcwd()
 target_dir = "/home/app/notebook"
 
+# Everything the Dockerfile copies into the image. A change to any of
+# these produces a new image tag and therefore a rebuild.
+build_inputs = [
+    "Dockerfile",
+    "requirements.txt",
+    "config/kernel.json",
+    "config/ipython_startup.py",
+]
+mount_label = "datalab-notebook.mount"
+
+# Subprocess output is relayed in chunks of up to this many bytes, with
+# at most `relay_queue_size` chunks waiting to be written. Once the queue
+# is full, readers stop reading and the child blocks on its own pipe.
+relay_chunk_size = 64 * 1024
+relay_queue_size = 16
+
+
+async def probe_jupyter_api(port):
+    """Return True if Jupyter's REST API answers on `port`
+    """
+    reader, writer = await asyncio.open_connection("localhost", port)
+    try:
+        writer.write(f"GET /api HTTP/1.0\r\nHost: localhost:{port}\r\n\r\n".encode())
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0].split(b" ")
+    return len(status_line) > 1 and status_line[1] == b"200" and "version" in json.loads(body)
+
+
+async def await_jupyter_http(port, deadline=60):
+    """Wait up to `deadline` seconds for the Jupyter API to answer,
+    backing off between attempts
+
+    Any connection-level error (refused, reset, timed out, half-open)
+    is treated as "not ready yet" rather than fatal.
 
-def await_jupyter_http(port):
-    """Wait up to 10 seconds for Jupyter to be available
     """
     print(f"Waiting for Jupyter to be ready on port {port}")
-    timeout = 10
-    increment = 0.1
-    counter = 0
-    url = f"http://localhost:{port}"
-    while counter < (timeout / increment):
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + deadline
+    delay = 0.05
+    while True:
+        remaining = give_up_at - loop.time()
+        if remaining <= 0:
+            break
         try:
-            with urllib.request.urlopen(url, timeout=timeout):
+            if await asyncio.wait_for(probe_jupyter_api(port), min(remaining, 5)):
                 return
-        except ConnectionResetError:
-            counter += 1
-            time.sleep(increment)
-        except socket.timeout:
-            break
+        except (OSError, asyncio.TimeoutError, ValueError):
+            pass
+        await asyncio.sleep(min(delay, max(give_up_at - loop.time(), 0)))
+        delay = min(delay * 2, 1.0)
+
+    raise SystemError(
+        f"Unable to reach Jupyter at http://localhost:{port}/api after {deadline} seconds"
+    )
+
+
+def jupyter_opener(port):
+    """Return a urllib opener carrying Jupyter's XSRF cookie, and the
+    headers needed to make API writes with it
+
+    """
+    cookies = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+    with opener.open(f"http://localhost:{port}/lab", timeout=10):
+        pass
+    headers = {"Content-Type": "application/json"}
+    for cookie in cookies:
+        if cookie.name == "_xsrf":
+            headers["X-XSRFToken"] = cookie.value
+    return opener, headers
+
+
+def prewarm_kernels(port, notebooks):
+    """Start a kernel session for each of `notebooks` so that opening
+    them attaches to a kernel which has already imported the analysis
+    stack (see `config/ipython_startup.py`)
+
+    """
+    opener, headers = jupyter_opener(port)
+    for path in notebooks:
+        if not os.path.exists(os.path.join(current_dir, path)):
+            print(f"Not pre-warming {path}: no such notebook")
+            continue
+        body = {
+            "path": path,
+            "name": os.path.basename(path),
+            "type": "notebook",
+            "kernel": {"name": "python3"},
+        }
+        request = urllib.request.Request(
+            f"http://localhost:{port}/api/sessions",
+            data=json.dumps(body).encode("utf8"),
+            headers=headers,
+            method="POST",
+        )
+        try:
+            with opener.open(request, timeout=10):
+                print(f"Pre-warming a kernel for {path}")
+        except (OSError, http.client.HTTPException) as e:
+            print(f"Could not pre-warm a kernel for {path}: {e}")
+
+
+def write_chunk(chunk):
+    """Write raw bytes to stdout, after anything already `print`ed
+    """
+    sys.stdout.flush()
+    sys.stdout.buffer.write(chunk)
+    sys.stdout.buffer.flush()
+
+
+async def relay_output(output):
+    """Copy chunks from the `output` queue to stdout until a None
+    sentinel arrives
+
+    Writes happen on a worker thread so a slow terminal can't stall the
+    event loop; the bounded queue pushes back on the readers instead.
+
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await output.get()
+        if chunk is None:
+            return
+        await loop.run_in_executor(None, write_chunk, chunk)
+
+
+async def stream_subprocess_output(cmd, output):
+    """Stream stdout and stderr of `cmd` in a subprocess to the `output`
+    queue, in chunks that end on a line boundary where possible
+
+    If cancelled, the subprocess is terminated before returning.
+
+    """
+    p = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    try:
+        pending = b""
+        while True:
+            chunk = await p.stdout.read(relay_chunk_size)
+            if not chunk:
+                break
+            pending += chunk
+            cut = pending.rfind(b"\n") + 1
+            if cut:
+                await output.put(pending[:cut])
+                pending = pending[cut:]
+            elif len(pending) >= relay_chunk_size:
+                await output.put(pending)
+                pending = b""
+        if pending:
+            await output.put(pending)
+        await p.wait()
+    except asyncio.CancelledError:
+        if p.returncode is None:
+            p.terminate()
+            await p.wait()
+        raise
+    if p.returncode > 0:
+        raise subprocess.CalledProcessError(cmd=cmd, returncode=p.returncode)
+
+
+def image_tag(tag):
+    """Return `tag` qualified with a content hash of the build inputs
+    """
+    digest = hashlib.sha256()
+    for path in build_inputs:
+        digest.update(path.encode("utf8"))
+        with open(os.path.join(current_dir, path), "rb") as f:
+            digest.update(f.read())
+    return f"{tag}:{digest.hexdigest()[:12]}"
+
 
-    raise SystemError(f"Unable to reach Jupyter at {url}")
+def mount_id():
+    """Return a short, label-safe identifier for the current checkout
+    """
+    return hashlib.sha256(current_dir.encode("utf8")).hexdigest()[:12]
 
 
-def stream_subprocess_output(cmd):
-    """Stream stdout and stderr of `cmd` in a subprocess to stdout
+def docker_image_exists(tag):
+    """Return True if an image with `tag` is present locally
     """
-    with subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        bufsize=1,
-        universal_newlines=True,
-    ) as p:
-        for line in p.stdout:
-            print(line, end="")
-        p.wait()
-        if p.returncode > 0:
-            raise subprocess.CalledProcessError(cmd=cmd, returncode=p.returncode)
+    completed_process = subprocess.run(
+        ["docker", "image", "inspect", tag], capture_output=True
+    )
+    return completed_process.returncode == 0
 
 
-def docker_build(tag):
-    """Build container for Dockerfile in current directory
+async def docker_build(tag, output):
+    """Build container for Dockerfile in current directory, unless an
+    image built from identical inputs already exists
+
     """
+    if docker_image_exists(tag):
+        print(f"Using existing docker image {tag}")
+        return
     print(
         "Building docker image. This may take some time (particularly on the first run)..."
     )
     buildcmd = ["docker", "build", "-t", tag, "-f", "Dockerfile", "."]
-    stream_subprocess_output(buildcmd)
+    await stream_subprocess_output(buildcmd, output)
+
+
+def docker_find_running(tag):
+    """Return the id of a live container started from `tag` for this
+    checkout, or None
+
+    """
+    completed_process = subprocess.run(
+        [
+            "docker",
+            "ps",
+            "--quiet",
+            "--filter",
+            f"label={mount_label}={mount_id()}",
+            "--filter",
+            f"ancestor={tag}",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    container_ids = completed_process.stdout.decode("utf8").split()
+    return container_ids[0] if container_ids else None
+
+
+def install_stop_handler(task):
+    """Cancel `task`, and with it every subprocess it is streaming, when
+    the user presses Ctrl+C
+
+    """
+    loop = asyncio.get_running_loop()
+
+    def stop_handler(sig, frame):
+        loop.call_soon_threadsafe(task.cancel)
 
+    signal.signal(signal.SIGINT, stop_handler)
 
-def docker_run(tag):
-    """Run docker in background, and install signal handler to stop it
-    again
 
+def docker_run(tag, preload=False):
+    """Run docker in background
     """
     print("Running docker...")
     runcmd = [
@@ -75,21 +271,29 @@ def docker_run(tag):
         "run",
         "--detach",  # in the background, so we can find out the port it's bound to
         "--rm",  # clean up the container after it's stopped
+        "--label",  # so a later run for this checkout can find and reuse it
+        f"{mount_label}={mount_id()}",
         "--mount",
         f"source={current_dir},dst={target_dir},type=bind",
+        "--env",  # read by config/ipython_startup.py in every new kernel
+        f"EUCTR_PRELOAD={int(preload)}",
         "--publish-all",
         tag,
     ]
     completed_process = subprocess.run(runcmd, check=True, capture_output=True)
     container_id = completed_process.stdout.decode("utf8").strip()
+    return container_id
 
-    def stop_handler(sig, frame):
-        print("Stopping docker...")
-        subprocess.run(["docker", "kill", container_id], check=True)
-        sys.exit(0)
 
-    signal.signal(signal.SIGINT, stop_handler)
+def docker_attach_or_run(tag, preload=False):
+    """Re-attach to a live container for this checkout if there is one,
+    otherwise start a new one
 
+    """
+    container_id = docker_find_running(tag)
+    if container_id is None:
+        return docker_run(tag, preload=preload)
+    print(f"Re-attaching to running container {container_id}")
     return container_id
 
 
@@ -104,16 +308,92 @@ def docker_port(container_id):
     return port
 
 
-def main():
-    docker_build(tag)
-    container_id = docker_run(tag)
-    port = docker_port(container_id)
-    await_jupyter_http(port)
-    webbrowser.open(f"http://localhost:{port}", new=2)  # Open in a new tab
-    print(
-        "To stop this docker container, use Ctrl+ C, or the File -> Shut Down menu in Jupyter Lab"
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--ready-timeout",
+        type=float,
+        default=60,
+        help="seconds to wait for Jupyter to start (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--prewarm",
+        action="append",
+        metavar="NOTEBOOK",
+        help="notebook to start a kernel for before the browser opens; "
+        "may be repeated (default: notebooks/Anlysis.ipynb)",
+    )
+    parser.add_argument(
+        "--no-prewarm",
+        action="store_true",
+        help="don't start any kernels ahead of time",
     )
-    stream_subprocess_output(["docker", "logs", "--follow", container_id])
+    parser.add_argument(
+        "--preload",
+        action="store_true",
+        help="also have kernels import lib, and have the first one warm the "
+        "OS page cache with the datasets (nothing is parsed ahead of time)",
+    )
+    return parser.parse_args()
+
+
+async def start(args):
+    """Build, start and follow the notebook container
+
+    The container's logs are tailed from the moment it starts, so they
+    stream while we wait for Jupyter and pre-warm kernels. Ctrl+C
+    cancels everything in flight and stops the container.
+
+    """
+    install_stop_handler(asyncio.current_task())
+    loop = asyncio.get_running_loop()
+    output = asyncio.Queue(maxsize=relay_queue_size)
+    relay = asyncio.ensure_future(relay_output(output))
+    children = []
+    container_id = None
+    try:
+        hashed_tag = image_tag(tag)
+        await docker_build(hashed_tag, output)
+        container_id = docker_attach_or_run(hashed_tag, preload=args.preload)
+        port = docker_port(container_id)
+        logs = asyncio.ensure_future(
+            stream_subprocess_output(
+                ["docker", "logs", "--follow", container_id], output
+            )
+        )
+        children.append(logs)
+        await await_jupyter_http(port, deadline=args.ready_timeout)
+        if not args.no_prewarm:
+            await loop.run_in_executor(
+                None,
+                prewarm_kernels,
+                port,
+                args.prewarm or ["notebooks/Anlysis.ipynb"],
+            )
+        webbrowser.open(f"http://localhost:{port}", new=2)  # Open in a new tab
+        print(
+            "To stop this docker container, use Ctrl+ C, or the File -> Shut Down menu in Jupyter Lab"
+        )
+        await logs
+    except asyncio.CancelledError:
+        if container_id is not None:
+            print("Stopping docker...")
+            subprocess.run(["docker", "kill", container_id], check=True)
+    finally:
+        for child in children:
+            child.cancel()
+        await asyncio.gather(*children, return_exceptions=True)
+        await output.put(None)
+        await relay
+
+
+def main():
+    # The Windows run.exe is built with Python 3.7, whose default
+    # SelectorEventLoop can't start subprocesses; the proactor loop can
+    # (and is the default from 3.8 on)
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    asyncio.run(start(parse_args()))
 
 
 if __name__ == "__main__":
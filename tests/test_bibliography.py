@@ -0,0 +1,23 @@
+import gzip
+import json
+
+import pytest
+
+from lib.bibliography import read_crossref
+
+def _item(day):
+    return {'DOI': f'10.1000/{day}', 'issued': {'date-parts': [[2010, 1, day]]}}
+
+DUMPS = {
+    'public.json': json.dumps({'items': [_item(1), _item(2)]}, indent=2),
+    'minified.json': json.dumps({'items': [_item(1), _item(2)]}),
+    'export.jsonl': '\n'.join(json.dumps({'message': _item(day)}) for day in (1, 2)) + '\n\n',
+}
+
+@pytest.mark.parametrize('gz', [False, True])
+@pytest.mark.parametrize('name', DUMPS)
+def test_read_crossref_formats(tmp_path, name, gz):
+    path = tmp_path / (name + '.gz' if gz else name)
+    with (gzip.open(path, 'wt') if gz else open(path, 'w')) as f:
+        f.write(DUMPS[name])
+    assert [doi for doi, _, _ in read_crossref(path)] == ['10.1000/1', '10.1000/2']
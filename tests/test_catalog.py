@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+from lib.catalog import Catalog
+from lib.census import census_summary
+from lib.datasets import load_dataset
+from lib.reporting import results_by_cutoff, results_inc
+
+EXAMPLE = pd.DataFrame({'id': ['2004-000091-14', None, '2005-000123-45'],
+                        'count': [1, None, 3],
+                        'score': [0.5, 1.5, None],
+                        'flag': [True, None, False],
+                        'date': pd.to_datetime(['2010-01-01', None, '2012-06-30'])})
+
+def _mapped(series):
+    #Buffers of a read-only mapping are immutable; anything converted or copied is not
+    chunks = series.array.__arrow_array__().chunks
+    return all(not b.is_mutable for c in chunks for b in c.buffers() if b is not None)
+
+def _same(a, b):
+    return a.astype(object).where(a.notna(), None).equals(b.astype(object).where(b.notna(), None))
+
+def test_load_shares_strings_and_keeps_numpy_types(tmp_path):
+    catalog = Catalog(tmp_path)
+    loaded = catalog.load('example', loader=lambda name: EXAMPLE)
+    assert catalog.references('example') == 1
+    assert loaded.id.dtype == pd.StringDtype('pyarrow') and _mapped(loaded.id)
+    assert loaded.score.dtype == 'float64'
+    assert loaded.date.dtype.kind == 'M'
+    assert _same(loaded, EXAMPLE)
+
+@pytest.mark.skipif(not hasattr(pd, 'ArrowDtype'), reason='needs pd.ArrowDtype')
+def test_load_arrow_shares_every_column(tmp_path):
+    loaded = Catalog(tmp_path).load('example', loader=lambda name: EXAMPLE, arrow=True)
+    for col in loaded.columns:
+        assert isinstance(loaded[col].dtype, pd.ArrowDtype) and _mapped(loaded[col]), col
+    assert _same(loaded, EXAMPLE)
+
+def test_loaded_frames_work_with_the_analysis_functions(tmp_path):
+    expected = load_dataset('analysis_df')
+    loaded = Catalog(tmp_path).load('analysis_df')
+    pd.testing.assert_frame_equal(results_inc(loaded, '2020-12-11'), results_inc(expected, '2020-12-11'))
+    pd.testing.assert_frame_equal(results_by_cutoff(loaded, ['2019-01-01', '2020-12-11']),
+                                  results_by_cutoff(expected, ['2019-01-01', '2020-12-11']))
+    pd.testing.assert_frame_equal(census_summary(loaded, '2020-12-11'), census_summary(expected, '2020-12-11'))
+    pd.testing.assert_frame_equal(census_summary(loaded, '2020-12-11', by='dual_searched'),
+                                  census_summary(expected, '2020-12-11', by='dual_searched'))
+
+def test_publish_evicts_to_fit(tmp_path):
+    catalog = Catalog(tmp_path, max_bytes=1)
+    catalog.publish('a', EXAMPLE)
+    catalog.publish('b', EXAMPLE)
+    assert 'a' not in catalog and 'b' in catalog
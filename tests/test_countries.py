@@ -0,0 +1,27 @@
+import pandas as pd
+
+from lib.countries import country_matrix, status_summary, trial_flags
+from lib.datasets import load_dataset
+from lib.functions import status_exclude
+
+def test_status_summary_matches_status_exclude():
+    protocols = load_dataset('protocols')
+    #Every trial in the search sample plus a slice of the rest, with many statuses and countries
+    trials = pd.Index(load_dataset('search_sample').eudract_number).union(protocols.eudract_number.unique()[:500])
+    protocols = protocols[protocols.eudract_number.isin(trials)]
+    expected = protocols.groupby('eudract_number').apply(status_exclude).astype('int64')
+    summary = status_summary(country_matrix(protocols))
+    summary.index.name = 'eudract_number'
+    pd.testing.assert_frame_equal(summary.sort_index(), expected.sort_index(), check_names=False)
+
+def test_trial_flags_count_third_country_once():
+    protocols = pd.DataFrame({'eudract_number': ['2004-000091-14'] * 3 + ['2005-000123-45'],
+                              'eudract_number_with_country': ['2004-000091-14-GB', '2004-000091-14-DE',
+                                                              '2004-000091-14-3rd', '2005-000123-45-FR'],
+                              'end_of_trial_status': ['Completed', None, 'Ongoing', 'Completed'],
+                              'trial_results': ['View results', None, None, None]})
+    flags = trial_flags(country_matrix(protocols))
+    assert flags.number_of_countries.tolist() == [3, 1]
+    assert flags.eu_countries.tolist() == [2, 1]
+    assert flags.third_country.tolist() == [True, False]
+    assert flags.multinational.tolist() == [True, False]
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.cube import ALL, OutcomeCube
+from lib.datasets import load_dataset
+
+DIMS = ['dual_searched', 'searched_by']
+
+@pytest.fixture(scope='module')
+def df():
+    return load_dataset('analysis_df')
+
+@pytest.mark.parametrize('outcome', ['euctr', 'ctgov', 'any'])
+def test_rollups_match_crosstab(df, outcome):
+    cube = OutcomeCube.build(df, DIMS)
+    col = {'euctr': 'euctr_results_inc', 'ctgov': 'ctgov_results_inc', 'any': 'any_results_inc'}[outcome]
+    counted = df[df.nct_id.notnull()] if outcome == 'ctgov' else df
+    #Missing searched_by is its own level in the cube, selected with None
+    rows, cols = counted.dual_searched, counted.searched_by.fillna('none')
+    reported = pd.crosstab(rows, cols, values=counted[col], aggfunc='sum', margins=True, margins_name=ALL).fillna(0)
+    total = pd.crosstab(rows, cols, margins=True, margins_name=ALL)
+    for r in total.index:
+        for c in total.columns:
+            cell = cube.query(outcome, dual_searched=r, searched_by=None if c == 'none' else c)
+            assert (cell.reported, cell.total) == (reported.loc[r, c], total.loc[r, c]), (r, c)
+
+def test_table_matches_query_and_round_trips(df, tmp_path):
+    cube = OutcomeCube.build(df, DIMS)
+    table = cube.table('euctr', 'searched_by', dual_searched=1)
+    for level, row in table.iterrows():
+        cell = cube.query('euctr', dual_searched=1, searched_by=None if pd.isna(level) else level)
+        assert (row.reported, row.total) == (cell.reported, cell.total)
+        assert np.isclose(row.proportion, cell.proportion)
+    cube.save(tmp_path / 'cube.npz')
+    loaded = OutcomeCube.load(tmp_path / 'cube.npz')
+    assert loaded.query('any', searched_by='JM') == cube.query('any', searched_by='JM')
@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+
+from lib.eudract import merge_on_eudract
+
+IDS = ['2004-000091-14', '2005-000123-45', 'bad', 'bad2', 'bad3', None]
+
+def _rows(df):
+    #Order-free comparison that treats every kind of missing value alike
+    df = df[['id', 'x', 'y']].astype(object)
+    return sorted(map(str, df.where(df.notna(), None).itertuples(index=False)))
+
+@pytest.mark.parametrize('how', ['left', 'inner', 'right', 'outer'])
+def test_missing_and_malformed_ids_join_as_strings_do(how):
+    left = pd.DataFrame({'id': ['2004-000091-14', 'bad', 'bad2', None, 'bad'], 'x': range(5)})
+    right = pd.DataFrame({'id': ['bad3', None, 'bad', '2004-000091-14', '2005-000123-45'], 'y': range(5)})
+    merged = merge_on_eudract(left, right, 'id', how=how)
+    expected = pd.merge(left, right, on='id', how=how)
+    assert len(merged) == len(expected)
+    assert _rows(merged) == _rows(expected)
+
+def test_unmatched_bad_ids_add_no_rows():
+    left = pd.DataFrame({'id': ['2004-000091-14', 'bad', 'bad2', None], 'x': range(4)})
+    right = pd.DataFrame({'id': ['bad3', None], 'y': range(2)})
+    assert len(merge_on_eudract(left, right, 'id')) == len(pd.merge(left, right, on='id', how='left')) == 4
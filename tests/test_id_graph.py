@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from lib.id_graph import IdGraph
+
+def _links(pairs, source='test'):
+    return pd.DataFrame({'id_a': [a for a, _ in pairs], 'id_b': [b for _, b in pairs], 'source': source})
+
+def test_clusters_match_connected_components():
+    rng = np.random.default_rng(0)
+    ids = np.array([f'NCT{i:08d}' for i in range(300)])
+    pairs = rng.integers(0, len(ids), (200, 2))
+    graph = IdGraph(_links([(ids[a], ids[b]) for a, b in pairs]))
+    codes = graph.ids.get_indexer(ids[pairs.ravel()]).reshape(-1, 2)
+    adjacency = sparse.coo_matrix((np.ones(len(codes)), (codes[:, 0], codes[:, 1])), shape=(len(graph),) * 2)
+    _, expected = connected_components(adjacency, directed=False)
+    #Same partition: each cluster maps to exactly one component and back
+    together = pd.DataFrame({'cluster': graph.cluster, 'component': expected}).drop_duplicates()
+    assert together.cluster.is_unique and together.component.is_unique
+
+def test_chains_and_lookups():
+    graph = IdGraph([_links([('2004-000091-14', 'NCT01234567')], 'nct_id'),
+                     _links([('NCT01234567', 'ISRCTN12345678'), ('2005-000123-45', 'NCT07654321')], 'secondary')])
+    assert graph.n_clusters == 2
+    assert set(graph.members('ISRCTN12345678').id) == {'2004-000091-14', 'NCT01234567', 'ISRCTN12345678'}
+    assert graph.same_cluster(['2004-000091-14', '2004-000091-14'], ['ISRCTN12345678', 'NCT07654321']).tolist() == \
+        [True, False]
+    assert graph.cluster_of('NCT99999999') == -1
+    coverage = graph.coverage().loc[graph.cluster_of('NCT01234567')]
+    assert (coverage.eudract, coverage.nct, coverage.isrctn, coverage.links) == (1, 1, 1, 2)
+    assert coverage.sources == ('nct_id', 'secondary')
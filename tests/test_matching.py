@@ -0,0 +1,33 @@
+import pandas as pd
+
+from lib.matching import candidates, evaluate, minhash, record_tokens, signatures
+
+LEFT = pd.DataFrame({'id': ['2004-000091-14', '2005-000123-45', '2006-001234-56'],
+                     'title': ['A randomised trial of aspirin for secondary prevention of stroke',
+                               'Metformin in adolescents with type 2 diabetes',
+                               'Long term follow up of hip replacement outcomes'],
+                     'sponsor': ['Bayer AG', 'Merck KGaA', 'University of Oxford']})
+RIGHT = pd.DataFrame({'id': ['NCT00000001', 'NCT00000002', 'NCT00000003'],
+                      'title': ['Aspirin for Secondary Prevention of Stroke: a Randomized Trial',
+                                'Vitamin D supplementation in older women',
+                                'Metformin in Adolescents With Type 2 Diabetes'],
+                      'sponsor': ['Bayer', 'Harvard University', 'Merck KGaA']})
+
+def test_minhash_estimates_jaccard():
+    records = pd.DataFrame({'title': [' '.join(f'w{i}' for i in range(0, 60)), ' '.join(f'w{i}' for i in range(20, 80))],
+                            'sponsor': [None, None]})
+    tokens = record_tokens(records, sponsor=None)
+    sig = minhash(tokens, 2, num_perm=512)
+    sets = [set(tokens.token[tokens.record == r]) for r in (0, 1)]
+    exact = len(sets[0] & sets[1]) / len(sets[0] | sets[1])
+    assert abs((sig[0] == sig[1]).mean() - exact) < 0.1
+
+def test_candidates_find_cross_registrations():
+    left, right = signatures(LEFT), signatures(RIGHT)
+    found = candidates(left, right)
+    best = found.sort_values('score', ascending=False).drop_duplicates('id_left').set_index('id_left').id_right
+    assert best['2004-000091-14'] == 'NCT00000001'
+    assert best['2005-000123-45'] == 'NCT00000003'
+    truth = pd.DataFrame({'id_left': ['2004-000091-14', '2005-000123-45'], 'id_right': ['NCT00000001', 'NCT00000003']})
+    report = evaluate(found, truth, left, right, thresholds=(0.0,))
+    assert report.loc[0.0, 'recall'] == 1.0
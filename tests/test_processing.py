@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.datasets import load_dataset
+from lib.processing import trial_population
+
+@pytest.fixture(scope='module')
+def population():
+    return trial_population(load_dataset('protocols'), load_dataset('results_scrape')).set_index('eudract_number')
+
+@pytest.mark.parametrize('sample', ['search_sample', 'replacement_sample'])
+def test_matches_the_processing_notebook_samples(population, sample):
+    #The samples were drawn from the Data Processing notebook's output, with its final_date and inferred
+    sample = load_dataset(sample)
+    found = population.loc[sample.eudract_number]
+    np.testing.assert_array_equal(found.final_date.to_numpy(), pd.to_datetime(sample.final_date).to_numpy())
+    np.testing.assert_array_equal(found.inferred.to_numpy(), sample.inferred.to_numpy())
+    assert (found.date_inclusion == 1).all()
+
+def test_one_row_per_trial_with_consistent_status(population):
+    assert population.index.is_unique
+    assert population.index.size == load_dataset('protocols').eudract_number.nunique()
+    extracted = population.exclusion_status == 'Extracted'
+    assert population.final_date[extracted].equals(population.available_completion[extracted])
+    assert population.final_date[population.exclusion_status.isin(['No EU Start', 'Cannot Infer'])].isna().all()
+    assert (population.inferred == (population.exclusion_status == 'Inferred')).all()
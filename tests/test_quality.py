@@ -0,0 +1,17 @@
+import pandas as pd
+
+from lib.quality import scan_dates
+
+FORMATS = {'date_of_competent_authority_decision': '%Y-%m-%d', 'date_of_the_global_end_of_the_trial': '%Y-%m-%d'}
+
+def test_scan_dates_checks():
+    raw = pd.DataFrame({'eudract_number': ['2004-000091-14', '2005-000123-45', '2006-001234-56', '2007-000001-11'],
+                        'date_of_competent_authority_decision': ['2010-01-01', '2010-13-01', '0210-05-05', '2012-01-01'],
+                        'date_of_the_global_end_of_the_trial': ['2012-01-01', None, '2030-01-01', '2011-01-01']})
+    scan = scan_dates(raw, FORMATS, as_of='2020-12-03')
+    found = set(zip(scan.issues.trial_id, scan.issues.check))
+    assert found == {('2005-000123-45', 'unparseable'), ('2006-001234-56', 'out of range'),
+                     ('2006-001234-56', 'future'), ('2007-000001-11', 'approval after completion')}
+    ordering = scan.issues[scan.issues.check == 'approval after completion'].iloc[0]
+    assert ordering.value == '2012-01-01 > 2011-01-01'
+    assert scan.counts['values'].sum() == len(scan.issues)
@@ -0,0 +1,72 @@
+import asyncio
+import socket
+from pathlib import Path
+
+import pandas as pd
+
+from lib.registry_fetch import RegistryFetcher, fixture_urls, serve_fixtures
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'registries'
+
+TRIALS = pd.DataFrame({
+    'euctr_id': ['2004-000091-14', '2005-000123-45', '2006-001234-56'],
+    'nct_id': ['NCT00000001', 'NCT00000002', 'NCT00000003'],
+    'isrctn_id': ['ISRCTN00000001', None, 'ISRCTN00000002'],
+})
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+async def _serving(port):
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            await asyncio.sleep(0.05)
+        else:
+            writer.close()
+            return
+    raise TimeoutError(f'Fixture server not up on port {port}')
+
+def test_results_dates_from_fixtures(tmp_path):
+    port = _free_port()
+    fetcher = RegistryFetcher(tmp_path / 'cache', urls=fixture_urls(f'http://127.0.0.1:{port}'), rate=0,
+                              backoff=0.01, timeout=5)
+    attempts = []
+    attempt = fetcher._attempt
+
+    async def counted(host, url):
+        attempts.append(url)
+        return await attempt(host, url)
+
+    fetcher._attempt = counted
+
+    async def run():
+        server = asyncio.ensure_future(serve_fixtures(FIXTURES, port=port, flaky=1))
+        try:
+            await _serving(port)
+            first = await fetcher.aresults_dates(TRIALS)
+            second = await fetcher.aresults_dates(TRIALS)
+            #All cached by now, so the blocking wrapper can run in this loop without the server
+            third = fetcher.results_dates(TRIALS)
+        finally:
+            server.cancel()
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    dates = first.set_index('id')
+    assert dates.results_date.dt.strftime('%Y-%m-%d').fillna('').to_dict() == {
+        'NCT00000001': '2014-05-07', 'NCT00000002': '', 'NCT00000003': '',
+        'ISRCTN00000001': '2015-03-02', 'ISRCTN00000002': ''}
+    assert dates.results.to_dict() == {'NCT00000001': True, 'NCT00000002': False, 'NCT00000003': None,
+                                       'ISRCTN00000001': True, 'ISRCTN00000002': False}
+    assert dates.status.to_dict()['NCT00000003'] == 404
+    assert first.error.isna().all()
+    #Every path was answered 503 once, then served
+    assert len(attempts) == 2 * len(first) and len(set(attempts)) == len(first)
+    assert not first.cached.any()
+    assert second.cached.all() and third.cached.all()
+    pd.testing.assert_frame_equal(second, third)
+    pd.testing.assert_frame_equal(first.drop(columns='cached'), second.drop(columns='cached'))
@@ -0,0 +1,21 @@
+import pandas as pd
+
+from lib.registry_ids import extract_ids, registry_of
+
+def test_extract_ids_normalizes_and_validates():
+    df = pd.DataFrame({'euctr_id': ['2004-000091-14', '2005-000123-45'],
+                       'journal_reg_numbers': ['NCT 01234567; ISRCTN12345678, EudraCT 2004–000091–14',
+                                               'nct01234567 and 1999-000001-01'],
+                       'nct_id': ['NCT01234567', None]})
+    ids = extract_ids(df, key='euctr_id')
+    found = set(zip(ids.euctr_id, ids.field, ids.id, ids.valid))
+    assert found == {('2004-000091-14', 'journal_reg_numbers', 'NCT01234567', True),
+                     ('2004-000091-14', 'journal_reg_numbers', 'ISRCTN12345678', True),
+                     ('2004-000091-14', 'journal_reg_numbers', '2004-000091-14', True),
+                     ('2004-000091-14', 'nct_id', 'NCT01234567', True),
+                     ('2005-000123-45', 'journal_reg_numbers', 'NCT01234567', True),
+                     ('2005-000123-45', 'journal_reg_numbers', '1999-000001-01', False)}
+
+def test_registry_of():
+    assert list(registry_of(['NCT01234567', 'ISRCTN12345678', '2004-000091-14', 'ABC-123'])) == \
+        ['nct', 'isrctn', 'eudract', 'other']
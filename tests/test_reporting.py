@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from lib.census import census_summary
+from lib.datasets import load_dataset
+from lib.reporting import results_by_cutoff, results_inc
+
+CUTOFF = '2020-12-11'
+
+def test_results_by_cutoff_matches_census_summary():
+    df = load_dataset('analysis_df')
+    cut = results_by_cutoff(df, [CUTOFF]).iloc[0]
+    summary = census_summary(df, CUTOFF)
+    for source, row in summary.iterrows():
+        assert cut[source] == row.reported, source
+        assert np.isclose(cut[f'{source}_prct'], row.proportion), source
+
+def test_results_by_cutoff_matches_results_inc():
+    df = load_dataset('analysis_df')
+    cut = results_by_cutoff(df, [CUTOFF], eligible={}).iloc[0]
+    flags = results_inc(df, CUTOFF).sum()
+    for source in ['euctr', 'ctgov', 'isrctn', 'journal', 'any']:
+        assert cut[source] == flags[f'{source}_results_inc'], source
+        assert cut[f'{source}_prct'] == flags[f'{source}_results_inc'] / len(df), source
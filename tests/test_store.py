@@ -0,0 +1,8 @@
+import pytest
+
+from lib.store import load_filtered
+
+@pytest.mark.parametrize('kwargs', [{'countries': ['GB']}, {'exclude_countries': ['3rd']}])
+def test_country_filters_need_protocol_country(tmp_path, kwargs):
+    with pytest.raises(ValueError, match='protocol_country'):
+        load_filtered('results', path=tmp_path / 'store.sqlite', **kwargs)
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from lib.trial_table import TrialTable
+
+IDS = ['2004-000091-14', '2005-000123-45', '2006-001234-56']
+
+def _table():
+    sample = pd.DataFrame({'eudract_number': ['2006-001234-56', '2004-000091-14', '2010-000001-11'],
+                           'inferred': [1, 0, 1], 'flag': [True, False, True], 'score': [0.5, 1.5, 2.5]})
+    return TrialTable(IDS).attach('sample', sample, 'eudract_number')
+
+def test_trials_with_no_row_get_nullable_values():
+    t = _table()
+    assert t['inferred'].dtype == 'Int64' and t['inferred'].tolist() == [0, pd.NA, 1]
+    assert t['flag'].dtype == 'boolean' and t['flag'].tolist() == [False, pd.NA, True]
+    assert t['score'].isna().tolist() == [False, True, False]
+
+def test_where_treats_missing_as_false():
+    t = _table()
+    kept = t.where(t['inferred'] == 1)
+    assert list(kept.index) == ['2006-001234-56']
+    assert kept['score'].tolist() == [0.5]